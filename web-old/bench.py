@@ -0,0 +1,675 @@
+#!/usr/bin/env python3
+"""
+ClawChat Benchmark - 合成 OpenClaw home + stub Gateway + 並發壓測
+
+用法:
+  python bench.py                                 # 預設規模，結果輸出到 bench-results/
+  python bench.py --sessions 500 --messages 400   # 放大資料量
+  python bench.py --endpoints /api/sessions,/api/chat
+  python bench.py --compare base.json new.json    # 比較兩次結果
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import random
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_PATH = os.path.join(SCRIPT_DIR, 'server.py')
+
+# 合成 agent 的名稱 (--agents 取前 N 個)
+AGENT_IDS = ['code', 'main', 'rich', 'chef', 'travel', 'startup', 'skill-manager', 'ip', 'nexchip']
+MODELS = ['anthropic/claude-sonnet-4', 'openai/gpt-4o', 'google/gemini-2.5-pro']
+ATTACHMENT_BODY = bytes(range(256)) * 256  # 壓測上傳用的 64KB 附件
+ATTACHMENT_ID = hashlib.sha256(ATTACHMENT_BODY).hexdigest()
+WORDS = ('the agent reads workspace files and answers with a short plan before running tools '
+         '排程 任務 留言板 工作區 檔案 回答 思考 工具').split()
+
+
+def _text(rng, size):
+    """產生約 size 字元的假文字"""
+    out = []
+    length = 0
+    while length < size:
+        w = rng.choice(WORDS)
+        out.append(w)
+        length += len(w) + 1
+    return ' '.join(out)[:size]
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+# ========== 合成 ~/.openclaw ==========
+
+def build_home(root, args):
+    """在 root 下建立合成的 ~/.openclaw 目錄樹，回傳 bin 目錄 (含 stub openclaw CLI)"""
+    rng = random.Random(args.seed)
+    now = time.time()
+    openclaw = os.path.join(root, '.openclaw')
+    workspaces = os.path.join(openclaw, 'workspaces')
+    agent_ids = AGENT_IDS[:args.agents]
+
+    agents_conf = []
+    catalog = []
+    for agent_id in agent_ids:
+        workspace = os.path.join(workspaces, agent_id)
+        os.makedirs(os.path.join(workspace, 'memory'), exist_ok=True)
+        agents_conf.append({
+            "id": agent_id,
+            "name": agent_id,
+            "workspace": workspace,
+            "agentDir": os.path.join(openclaw, 'agents', agent_id, 'agent'),
+            "identity": {"name": agent_id.title(), "emoji": '🤖', "description": f"{agent_id} agent"},
+            "model": {"primary": rng.choice(MODELS)},
+        })
+        with open(os.path.join(workspace, 'IDENTITY.md'), 'w') as f:
+            f.write(f"# IDENTITY\n\n- **Name:** {agent_id.title()}\n- **Emoji:** 🤖\n")
+        with open(os.path.join(workspace, 'HEARTBEAT.md'), 'w') as f:
+            f.write("# HEARTBEAT\n\n- check inbox\n- summarize board\n")
+        for md in ['SOUL.md', 'AGENTS.md', 'USER.md', 'TOOLS.md', 'MEMORY.md']:
+            with open(os.path.join(workspace, md), 'w') as f:
+                f.write(f"# {md}\n\n{_text(rng, 3000)}\n")
+        for i in range(args.workspace_files):
+            sub = 'memory' if i % 3 == 0 else ''
+            with open(os.path.join(workspace, sub, f'note-{i:04d}.md'), 'w') as f:
+                f.write(_text(rng, rng.randint(200, 4000)))
+        with open(os.path.join(workspace, 'screenshot.png'), 'wb') as f:
+            f.write(os.urandom(args.image_size))
+
+        sessions_dir = os.path.join(openclaw, 'agents', agent_id, 'sessions')
+        os.makedirs(sessions_dir, exist_ok=True)
+        for i in range(args.sessions):
+            session_id = f'{agent_id}-{i:05d}-{rng.getrandbits(32):08x}'
+            updated = now - rng.randint(0, 30 * 86400)
+            kind = rng.choice(['main', 'telegram', 'discord', 'cron', 'webchat'])
+            if kind == 'main':
+                key = f'agent:{agent_id}:openai-user:{agent_id}_session_{int(updated * 1000)}'
+            elif kind == 'cron':
+                key = f'agent:{agent_id}:cron:job-{i}'
+            else:
+                key = f'agent:{agent_id}:{kind}:direct:{rng.getrandbits(40)}'
+            model = rng.choice(MODELS)
+            total_tokens = 0
+            with open(os.path.join(sessions_dir, f'{session_id}.jsonl'), 'w') as f:
+                f.write(json.dumps({"type": "session", "id": session_id, "timestamp": _iso(updated)}) + '\n')
+                ts = updated - args.messages * 30
+                for m in range(args.messages):
+                    ts += 30
+                    if m % 2 == 0:
+                        message = {"role": "user", "content": [{"type": "text", "text": _text(rng, args.message_size)}]}
+                    else:
+                        content = []
+                        if m % 5 == 1:
+                            content.append({"type": "thinking", "thinking": _text(rng, args.message_size // 2)})
+                        if m % 7 == 1:
+                            content.append({"type": "toolCall", "id": f"call_{m}", "name": "read",
+                                            "arguments": {"path": f"note-{m:04d}.md"}})
+                        content.append({"type": "text", "text": f"<p>{_text(rng, args.message_size)}</p>"})
+                        tokens = rng.randint(200, 4000)
+                        total_tokens += tokens
+                        message = {"role": "assistant", "content": content, "model": model,
+                                   "usage": {"input": tokens - 100, "output": 100, "totalTokens": tokens}}
+                    f.write(json.dumps({"type": "message", "id": f"m{m}", "timestamp": _iso(ts),
+                                        "message": message}, ensure_ascii=False) + '\n')
+            catalog.append({
+                "key": key,
+                "sessionId": session_id,
+                "agentId": agent_id,
+                "updatedAt": int(updated * 1000),
+                "ageMs": int((now - updated) * 1000),
+                "model": model,
+                "totalTokens": total_tokens,
+                "contextTokens": 200000,
+                "label": rng.choice(['', '', 'ops', 'research']),
+            })
+
+    # 共用留言板 / Backlog
+    shared = os.path.join(workspaces, 'shared')
+    os.makedirs(shared, exist_ok=True)
+    with open(os.path.join(shared, 'BOARD.md'), 'w') as f:
+        f.write('# 公共留言板\n')
+        for i in range(args.board_posts):
+            stamp = datetime.fromtimestamp(now - i * 600)
+            if i % 20 == 0:
+                f.write(f"\n## {stamp.strftime('%Y-%m-%d')}\n\n")
+            f.write(f"- [{stamp.strftime('%Y-%m-%d %H:%M')}] **{rng.choice(agent_ids)}** 🤖 {_text(rng, 300)}\n")
+    with open(os.path.join(shared, 'BACKLOG.md'), 'w') as f:
+        f.write('# Backlog\n\n')
+        for section, status in [('### 🔵 To Do', 'TODO'), ('### 🟡 In Progress', 'WIP'), ('### ✅ Done', 'DONE')]:
+            f.write(section + '\n\n')
+            for i in range(args.board_posts // 3):
+                f.write(f"## [{status}] 任務 {section[-5:]} {i}\n")
+                f.write(f"- **提出者**: {rng.choice(agent_ids)}\n- **日期**: {_iso(now)[:10]}\n")
+                f.write(f"- **描述**: {_text(rng, 160)}\n- **認領者**: {rng.choice(agent_ids)}\n\n")
+
+    # Cron jobs
+    os.makedirs(os.path.join(openclaw, 'cron'), exist_ok=True)
+    jobs = []
+    for i in range(args.cron_jobs):
+        last_run = now - rng.randint(60, 86400)
+        jobs.append({
+            "id": f"job-{i}",
+            "name": f"排程 {i}",
+            "agentId": rng.choice(agent_ids),
+            "enabled": i % 4 != 0,
+            "schedule": {"kind": "cron", "expr": f"{i % 60} * * * *", "tz": "Asia/Taipei"},
+            "sessionTarget": "isolated",
+            "wakeMode": "now",
+            "payload": {"kind": "agentTurn", "message": _text(rng, 1500), "model": rng.choice(MODELS)},
+            "delivery": {"mode": "announce", "channel": "telegram", "to": "123"},
+            "state": {"nextRunAtMs": int((now + 3600) * 1000), "lastRunAtMs": int(last_run * 1000),
+                      "lastStatus": "ok", "lastDurationMs": rng.randint(500, 180000)},
+        })
+    with open(os.path.join(openclaw, 'cron', 'jobs.json'), 'w') as f:
+        json.dump({"version": 1, "jobs": jobs}, f, ensure_ascii=False)
+
+    config = {
+        "gateway": {"port": args.gateway_port, "http": {"port": args.gateway_port}, "auth": {"token": "bench-token"}},
+        "agents": {"list": agents_conf},
+        "channels": {
+            "telegram": {"enabled": True, "accounts": {"default": {"enabled": True, "botToken": "secret"}}},
+            "discord": {"enabled": False, "accounts": {"bot": {"enabled": True, "botToken": "secret"}}},
+        },
+    }
+    with open(os.path.join(openclaw, 'openclaw.json'), 'w') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    # stub `openclaw sessions --all-agents --json`
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    catalog_path = os.path.join(root, 'sessions-catalog.json')
+    with open(catalog_path, 'w') as f:
+        json.dump({"sessions": catalog, "count": len(catalog)}, f)
+    stub = os.path.join(bin_dir, 'openclaw')
+    with open(stub, 'w') as f:
+        f.write(f"#!{sys.executable}\nimport sys\nsys.stdout.write(open({catalog_path!r}).read())\n")
+    os.chmod(stub, 0o755)
+
+    return bin_dir, [s['sessionId'] for s in catalog], agent_ids
+
+
+# ========== Stub Gateway ==========
+
+class StubGatewayHandler(http.server.BaseHTTPRequestHandler):
+    """模擬 OpenClaw Gateway 的 /v1/chat/completions 與 /v1/responses"""
+    protocol_version = 'HTTP/1.1'
+    token_count = 50
+    token_rate = 200.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = b'{"ok":true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            raw = self.rfile.read(length)
+        elif self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            raw = self._read_chunked()
+        else:
+            raw = b''
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            body = {}
+        if body.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            delay = 1.0 / self.token_rate if self.token_rate > 0 else 0
+            try:
+                for i in range(self.token_count):
+                    if delay:
+                        time.sleep(delay)
+                    chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": f"tok{i} "}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.close_connection = True
+        else:
+            result = json.dumps({
+                "id": "chatcmpl-bench", "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant",
+                                                     "content": ' '.join(f'tok{i}' for i in range(self.token_count))}}],
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(result)))
+            self.end_headers()
+            self.wfile.write(result)
+
+    def _read_chunked(self):
+        data = b''
+        while True:
+            size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                self.rfile.readline()
+                return data
+            data += self.rfile.read(size)
+            self.rfile.readline()
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_stub_gateway(port, token_count, token_rate):
+    handler = type('BenchGatewayHandler', (StubGatewayHandler,),
+                   {'token_count': token_count, 'token_rate': token_rate})
+    httpd = _ThreadingServer(('127.0.0.1', port), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+# ========== 壓測 ==========
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree_rss_kb(pid):
+    """取得 pid 及其子行程的 RSS 總和 (KB)，僅支援 Linux /proc"""
+    total = 0
+    pending = [pid]
+    seen = set()
+    while pending:
+        p = pending.pop()
+        if p in seen:
+            continue
+        seen.add(p)
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+                        break
+            for tid in os.listdir(f'/proc/{p}/task'):
+                with open(f'/proc/{p}/task/{tid}/children') as f:
+                    pending.extend(int(c) for c in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.peak_kb = max(self.peak_kb, process_tree_rss_kb(self.pid))
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.peak_kb
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def do_request(port, method, path, body=None, headers=None):
+    """送出單一請求，回傳 (status, 總延遲秒, 首位元組延遲秒, 回應大小)"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        first = None
+        size = 0
+        while True:
+            chunk = resp.read1(65536) if hasattr(resp, 'read1') else resp.read(65536)
+            if not chunk:
+                break
+            if first is None:
+                first = time.perf_counter() - start
+            size += len(chunk)
+        return resp.status, time.perf_counter() - start, first, size
+    finally:
+        conn.close()
+
+
+def _ws_read(rfile):
+    """讀取一個 (伺服器端未遮罩的) WebSocket frame，回傳 (opcode, payload)"""
+    header = rfile.read(2)
+    if len(header) < 2:
+        raise ConnectionError('WebSocket closed')
+    length = header[1] & 0x7F
+    if length == 126:
+        length = int.from_bytes(rfile.read(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(rfile.read(8), 'big')
+    return header[0] & 0x0F, rfile.read(length)
+
+
+def do_ws_chat(port, path, body):
+    """透過 /api/ws 送出一則聊天並讀到 done，回傳值同 do_request (首位元組為第一個 chunk)"""
+    start = time.perf_counter()
+    sock = socket.create_connection(('127.0.0.1', port), timeout=60)
+    try:
+        key = base64.b64encode(os.urandom(16)).decode()
+        sock.sendall((f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\n'
+                      f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode())
+        rfile = sock.makefile('rb')
+        status = int(rfile.readline().split()[1])
+        while rfile.readline() not in (b'\r\n', b''):
+            pass
+        if status != 101:
+            return status, time.perf_counter() - start, None, 0
+        # 客戶端 frame 必須遮罩
+        mask = os.urandom(4)
+        n = len(body)
+        header = bytes([0x81, 0x80 | n]) if n < 126 else bytes([0x81, 0x80 | 126]) + n.to_bytes(2, 'big')
+        masked = (int.from_bytes(body, 'big') ^ int.from_bytes((mask * (n // 4 + 1))[:n], 'big')).to_bytes(n, 'big')
+        sock.sendall(header + mask + masked)
+        first = None
+        size = 0
+        while True:
+            opcode, payload = _ws_read(rfile)
+            if opcode == 0x8:
+                return 500, time.perf_counter() - start, first, size
+            if opcode != 0x1:
+                continue
+            msg = json.loads(payload)
+            if msg.get('type') == 'hello':
+                continue
+            if first is None:
+                first = time.perf_counter() - start
+            size += len(payload)
+            if msg.get('type') == 'done':
+                return 200, time.perf_counter() - start, first, size
+            if msg.get('type') == 'error':
+                return msg.get('status') or 500, time.perf_counter() - start, first, size
+    finally:
+        sock.close()
+
+
+def run_endpoint(port, spec, requests, concurrency):
+    method, path_fn, body, headers = spec
+    latencies = []
+    ttfb = []
+    errors = 0
+    total_bytes = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors, total_bytes
+        try:
+            if method == 'WS':
+                status, latency, first, size = do_ws_chat(port, path_fn(i), body)
+            else:
+                status, latency, first, size = do_request(port, method, path_fn(i), body, headers)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            if status >= 400:
+                errors += 1
+            latencies.append(latency)
+            if first is not None:
+                ttfb.append(first)
+            total_bytes += size
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - wall_start
+
+    def ms(v):
+        return round(v * 1000, 2) if v is not None else None
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughputRps": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "p50Ms": ms(percentile(latencies, 50)),
+        "p95Ms": ms(percentile(latencies, 95)),
+        "p99Ms": ms(percentile(latencies, 99)),
+        "maxMs": ms(max(latencies) if latencies else None),
+        "ttfbP50Ms": ms(percentile(ttfb, 50)),
+        "ttfbP95Ms": ms(percentile(ttfb, 95)),
+        "avgBytes": int(total_bytes / len(latencies)) if latencies else 0,
+    }
+
+
+def build_endpoints(session_ids, agent_ids, api_key):
+    """端點名稱 -> (method, path 產生函式, body, headers)；method 為 'WS' 時以 WebSocket 送出 body"""
+    auth = {'Authorization': f'Bearer {api_key}'}
+    rng = random.Random(0)
+
+    def const(path):
+        return lambda i: path
+
+    def chat_body(stream):
+        return json.dumps({"model": f"openclaw:{agent_ids[0]}", "stream": stream, "user": "bench_session_1",
+                           "messages": [{"role": "user", "content": "hello"}]}).encode()
+
+    json_headers = {'Content-Type': 'application/json'}
+    ws_chat = json.dumps({"type": "chat", "id": "bench", "sessionId": "bench_session_1",
+                          "path": "/v1/chat/completions", "body": json.loads(chat_body(True))}).encode()
+    return {
+        '/api/status': ('GET', const('/api/status'), None, {}),
+        '/api/agents': ('GET', const('/api/agents'), None, {}),
+        '/api/channels': ('GET', const('/api/channels'), None, auth),
+        '/api/config': ('GET', const('/api/config'), None, auth),
+        '/api/sessions': ('GET', const('/api/sessions'), None, {}),
+        f'/api/sessions?agentId={agent_ids[0]}': ('GET', const(f'/api/sessions?agentId={agent_ids[0]}'), None, {}),
+        '/api/session/<id>/messages': (
+            'GET', lambda i: f'/api/session/{rng.choice(session_ids)}/messages', None, {}),
+        '/api/agent/<id>': ('GET', lambda i: f'/api/agent/{agent_ids[i % len(agent_ids)]}', None, {}),
+        '/api/agent/<id>/files': ('GET', lambda i: f'/api/agent/{agent_ids[i % len(agent_ids)]}/files', None, {}),
+        '/api/agent/<id>/files?path=<image>': (
+            'GET', lambda i: f'/api/agent/{agent_ids[i % len(agent_ids)]}/files?path=screenshot.png', None, {}),
+        '/api/board': ('GET', const('/api/board'), None, auth),
+        '/api/backlog': ('GET', const('/api/backlog'), None, auth),
+        '/api/board/<file>': ('GET', const('/api/board/BOARD.md'), None, auth),
+        '/api/schedules': ('GET', const('/api/schedules'), None, {}),
+        '/api/cron': ('GET', const('/api/cron'), None, auth),
+        '/api/usage': ('GET', const('/api/usage'), None, auth),
+        '/api/session/<id>/export': (
+            'GET', lambda i: f'/api/session/{rng.choice(session_ids)}/export?format=ndjson', None, {}),
+        '/api/sessions/export?ids=<5>': (
+            'GET', lambda i: '/api/sessions/export?format=zip&ids=' + ','.join(rng.sample(session_ids, 5)), None, {}),
+        '/api/attachments (upload)': ('POST', const('/api/attachments'), ATTACHMENT_BODY,
+                                      {'Content-Type': 'image/png'}),
+        '/api/attachments/<sha>': ('GET', const(f'/api/attachments/{ATTACHMENT_ID}'), None, {}),
+        '/api/attachments/<sha> (HEAD)': ('HEAD', const(f'/api/attachments/{ATTACHMENT_ID}'), None, {}),
+        '/api/batch': ('POST', const('/api/batch'), json.dumps({"requests": [
+            '/api/status', '/api/agents', '/api/channels', '/api/sessions']}).encode(), dict(json_headers, **auth)),
+        '/lib/vue.js': ('GET', const('/lib/vue.js'), None, {}),
+        '/index.html': ('GET', const('/index.html'), None, {}),
+        '/api/chat (stream)': ('POST', const('/api/chat'), chat_body(True), json_headers),
+        '/api/chat': ('POST', const('/api/chat'), chat_body(False), json_headers),
+        '/v1/responses': ('POST', const('/v1/responses'), chat_body(False), json_headers),
+        '/api/ws (chat)': ('WS', const('/api/ws'), ws_chat, {}),
+    }
+
+
+def wait_for_server(port, proc, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server.py exited with code {proc.returncode}')
+        try:
+            status, _, _, _ = do_request(port, 'GET', '/api/agents')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError('server.py did not start in time')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(args):
+    root = args.home or tempfile.mkdtemp(prefix='clawchat-bench-')
+    args.gateway_port = args.gateway_port or free_port()
+    port = args.port or free_port()
+    print(f'📁 synthetic home: {root}')
+    bin_dir, session_ids, agent_ids = build_home(root, args)
+
+    gateway = start_stub_gateway(args.gateway_port, args.tokens, args.token_rate)
+    env = dict(os.environ)
+    env.update({
+        'HOME': root,
+        'PORT': str(port),
+        'GATEWAY_URL': f'http://127.0.0.1:{args.gateway_port}',
+        'GATEWAY_TOKEN': 'bench-token',
+        'OPENCLAW_CONFIG_PATH': os.path.join(root, '.openclaw', 'openclaw.json'),
+        'API_KEY': args.api_key,
+        'PATH': bin_dir + os.pathsep + env.get('PATH', ''),
+    })
+    env.update(dict(item.split('=', 1) for item in args.server_env))
+    proc = subprocess.Popen([sys.executable, SERVER_PATH], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        wait_for_server(port, proc)
+        # 先上傳一次附件，單獨測試 GET /api/attachments/<sha> 時也不會 404
+        do_request(port, 'POST', '/api/attachments', ATTACHMENT_BODY, {'Content-Type': 'image/png'})
+        sampler = RSSSampler(proc.pid)
+        sampler.start()
+        endpoints = build_endpoints(session_ids, agent_ids, args.api_key)
+        filters = [e for e in args.endpoints.split(',') if e] if args.endpoints else []
+        for name, spec in endpoints.items():
+            if filters and not any(name.startswith(f) for f in filters):
+                continue
+            count = args.chat_requests if name.startswith(('/api/chat', '/v1/', '/api/ws')) else args.requests
+            results[name] = run_endpoint(port, spec, count, args.concurrency)
+            r = results[name]
+            ttfb = f"  ttfb p50 {r['ttfbP50Ms']}ms" if name.startswith(('/api/chat', '/v1/', '/api/ws')) else ''
+            print(f"{name:42s} {r['throughputRps']:>9} req/s  p50 {r['p50Ms']}ms  p95 {r['p95Ms']}ms  "
+                  f"p99 {r['p99Ms']}ms{ttfb}  errors {r['errors']}")
+        peak_kb = sampler.stop()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        gateway.shutdown()
+        if not args.keep_home and not args.home:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'home', 'keep_home')},
+        "peakRssKb": peak_kb,
+        "endpoints": results,
+    }
+    out = args.out or os.path.join(SCRIPT_DIR, 'bench-results',
+                                   f"{report['commit'] or 'nogit'}-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'📈 peak RSS: {peak_kb} KB')
+    print(f'💾 results: {out}')
+    return report
+
+
+def compare(base_path, new_path):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"base {base.get('commit')} → new {new.get('commit')}")
+    for name, r in new.get('endpoints', {}).items():
+        b = base.get('endpoints', {}).get(name)
+        if not b:
+            continue
+        cells = []
+        for metric in ['throughputRps', 'p50Ms', 'p95Ms', 'p99Ms', 'ttfbP50Ms']:
+            old, cur = b.get(metric), r.get(metric)
+            if old and cur:
+                cells.append(f"{metric} {old}→{cur} ({(cur - old) / old * 100:+.1f}%)")
+        print(f"{name:42s} " + '  '.join(cells))
+    print(f"peakRssKb {base.get('peakRssKb')}→{new.get('peakRssKb')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ClawChat server.py benchmark')
+    parser.add_argument('--agents', type=int, default=3, help='agent 數量 (最多 %d)' % len(AGENT_IDS))
+    parser.add_argument('--sessions', type=int, default=50, help='每個 agent 的 session 數')
+    parser.add_argument('--messages', type=int, default=200, help='每個 transcript 的訊息數')
+    parser.add_argument('--message-size', type=int, default=400, help='每則訊息字元數')
+    parser.add_argument('--workspace-files', type=int, default=30, help='每個 workspace 的檔案數')
+    parser.add_argument('--image-size', type=int, default=512 * 1024, help='workspace 圖片大小 (bytes)')
+    parser.add_argument('--cron-jobs', type=int, default=20)
+    parser.add_argument('--board-posts', type=int, default=300)
+    parser.add_argument('--tokens', type=int, default=50, help='stub gateway 每次回覆的 token 數')
+    parser.add_argument('--token-rate', type=float, default=200.0, help='stub gateway 每秒輸出 token 數')
+    parser.add_argument('--requests', type=int, default=200, help='每個 GET 端點的請求數')
+    parser.add_argument('--chat-requests', type=int, default=40, help='每個聊天端點的請求數')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--endpoints', default='', help='只測試這些前綴的端點 (逗號分隔)')
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='傳給 server.py 的額外環境變數')
+    parser.add_argument('--api-key', default='bench-key')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--gateway-port', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--home', help='使用 (並保留) 指定目錄作為合成 home')
+    parser.add_argument('--keep-home', action='store_true', help='結束後保留合成 home')
+    parser.add_argument('--out', help='結果 JSON 路徑')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='比較兩份結果 JSON')
+    args = parser.parse_args()
+    args.agents = max(1, min(args.agents, len(AGENT_IDS)))
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
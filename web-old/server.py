@@ -3,15 +3,91 @@
 ClawChat Server - HTTP + API proxy for OpenClaw Gateway
 """
 import http.server
+import http.client
 import socketserver
 import json
 import urllib.request
 import urllib.error
 import os
+import sys
 import time
+import threading
+import contextlib
+import cProfile
+import pstats
+import signal
+import sqlite3
+import re
+import hashlib
+import base64
+import bisect
+import struct
+import socket
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# .env 設定檔：啟動時載入 (已設定的環境變數優先)，收到 SIGHUP 時重新讀取
+ENV_FILE = os.path.expanduser(os.environ.get('ENV_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')))
+# 啟動時的環境變數 (不含交接用的變數)；重新載入設定與啟動新行程時以此為基礎
+BASE_ENV = {k: v for k, v in os.environ.items() if not k.startswith('CLAWCHAT_HANDOFF_')}
+
+def read_env_file(path):
+    """解析 KEY=VALUE 格式的 .env 檔 (忽略註解與空行)"""
+    values = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                key = key.strip()
+                if key.startswith('export '):
+                    key = key[7:].strip()
+                value = value.strip()
+                if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+                    value = value[1:-1]
+                values[key] = value
+    except OSError:
+        pass
+    return values
+
+def load_env():
+    """以 .env 的內容 + 啟動時的環境變數重建 os.environ，回傳有變動的變數名稱"""
+    env = dict(read_env_file(ENV_FILE), **BASE_ENV)
+    changed = {k for k in set(env) | set(os.environ) if env.get(k) != os.environ.get(k)
+               and not k.startswith('CLAWCHAT_HANDOFF_')}
+    for key in changed:
+        if key in env:
+            os.environ[key] = env[key]
+        else:
+            del os.environ[key]
+    return changed
+
+load_env()
+
+# 可由 SIGHUP 即時重新載入的設定：名稱 -> (轉換函式, 預設值)；啟動時的初始值也由此讀取
+RELOADABLE_SETTINGS = {
+    'GATEWAY_URL': (str, 'http://127.0.0.1:18789'),
+    'API_KEY': (str, ''),
+    'CORS_ORIGINS': (lambda v: v.split(','), 'localhost,127.0.0.1'),
+    'ATTACHMENT_MAX_BYTES': (int, 10 * 1024 * 1024),
+    'ATTACHMENT_STORE_BYTES': (int, 500 * 1024 * 1024),
+    'KEEPALIVE_TIMEOUT': (int, 15),
+    'KEEPALIVE_MAX_REQUESTS': (int, 100),
+    'GATEWAY_CONNECT_TIMEOUT': (float, 5),
+    'GATEWAY_FIRST_BYTE_TIMEOUT': (float, 120),
+    'GATEWAY_IDLE_TIMEOUT': (float, 60),
+    'GATEWAY_FAILURE_THRESHOLD': (int, 5),
+    'DRAIN_TIMEOUT': (int, 300),
+}
+
+def env_setting(name):
+    """依 RELOADABLE_SETTINGS 讀取環境變數 (未設定時使用預設值)"""
+    cast, default = RELOADABLE_SETTINGS[name]
+    return cast(os.environ.get(name, default))
 
 PORT = int(os.environ.get('PORT', 8093))
-GATEWAY_URL = os.environ.get('GATEWAY_URL', 'http://127.0.0.1:18789')
+GATEWAY_URL = env_setting('GATEWAY_URL')
 CONFIG_PATH = os.path.expanduser(os.environ.get('OPENCLAW_CONFIG_PATH', '~/.openclaw/openclaw.json'))
 
 # 從配置檔讀取 token
@@ -26,9 +102,9 @@ def get_gateway_token():
 GATEWAY_TOKEN = os.environ.get('GATEWAY_TOKEN', get_gateway_token())
 
 # API Key for authentication (optional - set to protect API endpoints)
-API_KEY = os.environ.get('API_KEY', '')
+API_KEY = env_setting('API_KEY')
 # CORS allowed origins (comma-separated, default: localhost only)
-CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'localhost,127.0.0.1').split(',')
+CORS_ORIGINS = env_setting('CORS_ORIGINS')
 
 def get_allowed_origin(origin=None):
     """取得允許的 CORS origin"""
@@ -40,6 +116,13 @@ def get_allowed_origin(origin=None):
             return origin
     return None
 
+# 敏感端點需要 API Key 認證
+SENSITIVE_PATHS = ['/api/channels', '/api/config', '/api/board', '/api/cron', '/api/backlog', '/api/usage']
+
+def needs_api_key(path):
+    """檢查路徑是否為敏感端點"""
+    return any(path.startswith(p) for p in SENSITIVE_PATHS)
+
 def check_api_key(headers):
     """檢查 API Key認證"""
     if not API_KEY:
@@ -56,26 +139,2005 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # 快取配置
 CACHE_TTL = 30  # 快取有效期（秒）
+CACHE_MAX_ENTRIES = 512  # 記憶體快取上限，超過時淘汰最舊的項目
 _cache = {}
 
-def get_cached(key, fetch_func, ttl=CACHE_TTL):
-    """簡單的記憶體快取"""
+# 多行程模式：worker 數量 (1 = 單行程)，以及 worker 之間共用的快取檔
+WORKERS = int(os.environ.get('WORKERS', 1))
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', '')
+IN_WORKER = False  # 目前行程是否為 pre-fork worker (run_worker 設定)
+# 持久化快取檔 (可選)：重啟後依來源檔案 mtime 驗證並直接沿用，避免冷啟動
+CACHE_DB = os.path.expanduser(os.environ.get('CACHE_DB', ''))
+CACHE_DB_MAX_AGE = 7 * 86400  # 超過此時間未更新的項目於啟動時清除
+
+def file_signature(paths):
+    """取得檔案/目錄的 (mtime, size) 簽章，用於驗證快取是否過期"""
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig.append([path, st.st_mtime_ns, st.st_size])
+        except OSError:
+            sig.append([path, None, None])
+    return sig
+
+class SharedCache:
+    """以本機 SQLite 檔實作的跨行程 / 持久化快取，讓各 worker 不必各自重建"""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('DELETE FROM cache WHERE ts < ?', (time.time() - CACHE_DB_MAX_AGE,))
+
+    def _conn(self):
+        # sqlite 連線不可跨執行緒 / fork 共用，依 (pid, thread) 各自建立
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, ts REAL, deps TEXT)')
+            try:
+                conn.execute('ALTER TABLE cache ADD COLUMN deps TEXT')
+            except sqlite3.OperationalError:
+                pass
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value, ts, deps FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], json.loads(row[2]) if row[2] else None
+
+    def set(self, key, data, timestamp, sig=None):
+        self._conn().execute('INSERT OR REPLACE INTO cache (key, value, ts, deps) VALUES (?, ?, ?, ?)',
+                             (key, json.dumps(data, ensure_ascii=False), timestamp,
+                              json.dumps(sig) if sig is not None else None))
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache')
+
+    def update(self, key, func):
+        """在寫入交易中讀取、以 func(舊值或 None) 計算新值並寫回，回傳新值 (多個行程同時更新也不會互相覆蓋)"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            data = func(json.loads(row[0]) if row else None)
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, ts, deps) VALUES (?, ?, ?, NULL)',
+                         (key, json.dumps(data, ensure_ascii=False), time.time()))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return data
+
+    def items(self, prefix):
+        """取得 key 以 prefix 開頭的所有項目 [(key, value), ...]"""
+        rows = self._conn().execute('SELECT key, value FROM cache WHERE key >= ? AND key < ?',
+                                    (prefix, prefix + '\uffff')).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+_shared_cache = None
+
+def init_shared_cache(path):
+    """啟用共用 / 持久化快取 (失敗時退回純記憶體快取)"""
+    global _shared_cache
+    try:
+        _shared_cache = SharedCache(path)
+    except Exception as e:
+        print(f"⚠️ Shared cache disabled: {e}")
+        _shared_cache = None
+
+def get_cached(key, fetch_func, ttl=CACHE_TTL, deps=None):
+    """簡單的記憶體快取 (有共用 / 持久化快取時再查該快取)
+
+    deps: 資料來源的檔案/目錄列表；指定時以其 mtime 驗證快取，變更時提早失效 (不會延長 ttl)。
+    ttl:  None 表示只依 deps 驗證 (此時共用快取中簽章相符的項目重啟後可立即沿用)
+    """
     now = time.time()
-    if key in _cache:
-        data, timestamp = _cache[key]
-        if now - timestamp < ttl:
+    sig = file_signature(deps) if deps is not None else None
+    entry = _cache.get(key)
+    if entry is not None:
+        data, timestamp, entry_sig = entry
+        if (ttl is None or now - timestamp < ttl) and entry_sig == sig:
             return data
+    if _shared_cache is not None:
+        try:
+            stored = _shared_cache.get(key)
+        except Exception:
+            stored = None
+        if stored is not None:
+            data, timestamp, stored_sig = stored
+            if (ttl is None or now - timestamp < ttl) and stored_sig == sig and (sig is not None or ttl is not None):
+                _set_memory_cache(key, (data, timestamp, sig))
+                return data
     # 重新取得
     data = fetch_func()
-    _cache[key] = (data, now)
+    _set_memory_cache(key, (data, now, sig))
+    if _shared_cache is not None:
+        try:
+            _shared_cache.set(key, data, now, sig)
+        except Exception:
+            pass
     return data
 
+def session_index_paths():
+    """session 列表的來源檔案 (各 agent 的 sessions 目錄與 sessions.json)"""
+    agents_dir = os.path.expanduser('~/.openclaw/agents')
+    paths = [agents_dir]
+    try:
+        for agent in sorted(os.listdir(agents_dir)):
+            sessions_dir = os.path.join(agents_dir, agent, 'sessions')
+            paths.append(sessions_dir)
+            paths.append(os.path.join(sessions_dir, 'sessions.json'))
+    except OSError:
+        pass
+    return paths
+
+def format_age(age_ms):
+    """格式化時間差"""
+    if age_ms < 60000:
+        return f"{age_ms//1000}秒前"
+    elif age_ms < 3600000:
+        return f"{age_ms//60000}分前"
+    elif age_ms < 86400000:
+        return f"{age_ms//3600000}小時前"
+    else:
+        return f"{age_ms//86400000}天前"
+
+# ========== Session 查詢索引 ==========
+SESSION_FILTERS = ('agentId', 'source', 'label')  # 可篩選的欄位 (參數值可用逗號分隔多個)
+SESSION_PAGE_MAX = 500         # limit 上限
+SESSION_TOMBSTONE_MAX = 1000   # 保留的已移除 session 記錄數 (供 since 差異查詢)
+
+class SessionIndex:
+    """session 列表的查詢索引
+
+    sessions 依 (updatedAt 由新到舊, id) 排序，時間範圍與游標以二分搜尋定位；
+    agentId / source / label 各自建立 值 -> 位置 的分組。列表重新抓取時比對前後差異，
+    以該次抓取的時間 (fetchedAt，伺服器時鐘) 作為版本，記錄每個 session 最後變動與被移除的版本；
+    客戶端以回傳的 version 作為 since 取得差異。變動紀錄只涵蓋本行程首次建立索引 (baseline)
+    之後，since 早於 baseline 時回傳完整列表 (full)。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self.baseline = None  # 首次建立索引的版本 (ms)
+        self.version = 0
+        self.sessions = []
+        self.keys = []
+        self.groups = {}
+        self.changed = {}  # session id -> 最後變動的版本
+        self.removed = {}  # session id -> 移除的版本
+
+    def update(self, data):
+        token = (data.get('fetchedAt'), data.get('count'))
+        if token == self._token:
+            return
+        with self._lock:
+            if token == self._token:
+                return
+            sessions = sorted(data.get('sessions', []), key=lambda x: (-(x.get('updatedAt') or 0), x.get('id', '')))
+            ids = {x.get('id') for x in sessions}
+            version = max(data.get('fetchedAt') or int(time.time() * 1000), self.version)
+            if self.baseline is None:
+                self.baseline = version
+            previous = {x.get('id'): x.get('updatedAt') for x in self.sessions}
+            changed = {}
+            for x in sessions:
+                sid = x.get('id')
+                if self._token is not None and previous.get(sid, -1) != x.get('updatedAt'):
+                    changed[sid] = version
+                else:
+                    changed[sid] = self.changed.get(sid, version)
+            if self._token is not None:
+                for sid in previous:
+                    if sid not in ids:
+                        self.removed[sid] = version
+            for sid in ids:
+                self.removed.pop(sid, None)
+            while len(self.removed) > SESSION_TOMBSTONE_MAX:
+                self.removed.pop(next(iter(self.removed)))
+            groups = {name: {} for name in SESSION_FILTERS}
+            for i, x in enumerate(sessions):
+                for name in SESSION_FILTERS:
+                    groups[name].setdefault(x.get(name) or '', []).append(i)
+            self.sessions = sessions
+            self.keys = [(-(x.get('updatedAt') or 0), x.get('id', '')) for x in sessions]
+            self.groups = groups
+            self.changed = changed
+            self.version = version
+            self._token = token
+
+    def query(self, filters=None, since=None, start=None, end=None, cursor=None, limit=None):
+        """篩選並分頁
+
+        filters: {欄位: [值, ...]}；since: 先前回傳的 version，只回傳之後有變動的 session；
+        start/end: updatedAt 範圍 (含)；cursor: 上一頁回傳的 nextCursor。
+        """
+        with self._lock:
+            sessions, keys, groups = self.sessions, self.keys, self.groups
+            changed, removed = self.changed, dict(self.removed)
+            baseline, version = self.baseline, self.version
+        # 無法確定 since 之後變動了哪些 session 時改回傳完整列表
+        full = since is not None and (baseline is None or since < baseline)
+        requested_since = since is not None
+        if full:
+            since = None
+        lo, hi = 0, len(keys)
+        if end is not None:
+            lo = bisect.bisect_left(keys, (-end, ''))
+        if start is not None:
+            hi = min(hi, bisect.bisect_right(keys, (-start, '\U0010ffff')))
+        total_lo = lo
+        if cursor is not None:
+            lo = max(lo, bisect.bisect_right(keys, cursor))
+        
+        candidates = None
+        if since is not None:
+            candidates = {i for i, (_, sid) in enumerate(keys) if changed.get(sid, 0) > since}
+        for name, values in (filters or {}).items():
+            positions = set()
+            for value in values:
+                positions.update(groups.get(name, {}).get(value, []))
+            candidates = positions if candidates is None else candidates & positions
+        if candidates is None:
+            matched = range(total_lo, max(total_lo, hi))
+        else:
+            matched = sorted(i for i in candidates if total_lo <= i < hi)
+        
+        if candidates is None:
+            remaining = range(lo, max(lo, hi))
+        else:
+            remaining = [i for i in matched if i >= lo]
+        page = remaining[:limit] if limit is not None else remaining
+        result = {
+            "sessions": [sessions[i] for i in page],
+            "count": len(page),
+            "total": len(matched),
+            "nextCursor": None,
+            "latest": -keys[0][0] if keys else 0,
+            "version": version,
+        }
+        if len(page) < len(remaining):
+            updated_at, sid = keys[page[-1]]
+            result["nextCursor"] = f"{-updated_at}:{sid}"
+        if requested_since:
+            result["full"] = full
+            result["removed"] = [] if full else [sid for sid, ts in removed.items() if ts > since]
+        return result
+
+SESSION_INDEX = SessionIndex()
+
+# ========== 用量統計 (增量彙總) ==========
+USAGE_REFRESH_INTERVAL = 5  # 秒；間隔內的查詢直接使用現有彙總，不重新掃描檔案
+USAGE_DIMENSIONS = ('agentId', 'model', 'source', 'day')
+USAGE_COUNTERS = ('messages', 'userMessages', 'assistantMessages', 'toolCalls',
+                  'inputTokens', 'outputTokens', 'cacheReadTokens', 'cacheWriteTokens', 'totalTokens', 'cost')
+CRON_COUNTERS = ('runs', 'errors', 'durationMs')
+
+def usage_day(ts):
+    """transcript 時間戳 (ISO 字串或毫秒) 轉為本地日期 YYYY-MM-DD"""
+    from datetime import datetime
+    try:
+        if isinstance(ts, (int, float)):
+            t = ts / 1000
+        else:
+            t = datetime.fromisoformat(str(ts).replace('Z', '+00:00')).timestamp()
+        return time.strftime('%Y-%m-%d', time.localtime(t))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return 'unknown'
+
+class TranscriptUsage:
+    """單一 transcript 的彙總：已讀到的 byte offset 與 (日期, 模型) -> 計數
+
+    有共用快取時以 usage:file:<路徑> 保存 (含 inode)，重啟後與其他 worker 從已讀到的位置接續。
+    """
+    def __init__(self, agent_id, session_id):
+        self.agent_id = agent_id
+        self.session_id = session_id
+        self.inode = None
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.model = ''
+        self.buckets = {}
+
+    def to_record(self):
+        return {"inode": self.inode, "offset": self.offset, "model": self.model,
+                "buckets": [[day, model, counters] for (day, model), counters in self.buckets.items()]}
+
+    def load_record(self, record, st):
+        """採用共用快取中同一個檔案 (inode 相同) 且讀得更遠的彙總"""
+        if not record or record.get('inode') != st.st_ino or not self.offset < record['offset'] <= st.st_size:
+            return
+        self.inode = st.st_ino
+        self.offset = record['offset']
+        self.model = record['model']
+        self.buckets = {(day, model): counters for day, model, counters in record['buckets']}
+
+    def consume(self, path, st):
+        """只讀取上次之後新增的完整行；檔案被替換或截斷時從頭重算"""
+        if st.st_ino == self.inode and st.st_size == self.offset:
+            return
+        key = f'usage:file:{path}'
+        if _shared_cache is not None:
+            stored = _shared_cache.get(key)
+            self.load_record(stored[0] if stored else None, st)
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self.reset()
+            self.inode = st.st_ino
+        if st.st_size == self.offset:
+            return
+        start = self.offset
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # 寫到一半的行留待下次
+                self.offset += len(line)
+                self.add(line)
+        if _shared_cache is not None and self.offset != start:
+            # 其他行程已寫入更新的彙總時保留對方的
+            _shared_cache.update(key, lambda old: old if old and old.get('inode') == self.inode
+                                 and old.get('offset', 0) >= self.offset else self.to_record())
+
+    def add(self, line):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return
+        kind = entry.get('type')
+        if kind == 'model_change':
+            self.model = entry.get('modelId') or self.model
+            return
+        if kind != 'message':
+            return
+        msg = entry.get('message') or {}
+        if msg.get('model'):
+            self.model = msg['model']
+        key = (usage_day(entry.get('timestamp')), self.model)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = dict.fromkeys(USAGE_COUNTERS, 0)
+        bucket['messages'] += 1
+        role = msg.get('role')
+        if role == 'user':
+            bucket['userMessages'] += 1
+        elif role == 'assistant':
+            bucket['assistantMessages'] += 1
+        content = msg.get('content')
+        if isinstance(content, list):
+            bucket['toolCalls'] += sum(1 for c in content if isinstance(c, dict) and c.get('type') == 'toolCall')
+        usage = msg.get('usage')
+        if isinstance(usage, dict):
+            bucket['inputTokens'] += usage.get('input') or 0
+            bucket['outputTokens'] += usage.get('output') or 0
+            bucket['cacheReadTokens'] += usage.get('cacheRead') or 0
+            bucket['cacheWriteTokens'] += usage.get('cacheWrite') or 0
+            bucket['totalTokens'] += usage.get('totalTokens') or 0
+            cost = usage.get('cost')
+            bucket['cost'] += (cost.get('total') or 0) if isinstance(cost, dict) else (cost or 0)
+
+class UsageRollup:
+    """各 agent / 模型 / 來源 / 日期的用量彙總
+
+    transcript 依 byte offset 增量讀取，查詢只走訪彙總桶 (與訊息總數無關)；
+    cron 執行紀錄取自 jobs.json 的 state，以 (jobId, lastRunAtMs) 去重累積。
+    有共用快取時兩者都保存在其中 (usage:file:*、usage:cron)，各 worker 與重啟後共用同一份。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = {}       # transcript 路徑 -> TranscriptUsage
+        self.cron_runs = {}   # (jobId, lastRunAtMs) -> (agentId, 日期, durationMs, status)
+        self.cron_sig = None
+        self.cron_shared_ts = None
+        self.refreshed_at = 0
+
+    def refresh(self):
+        with self._lock:
+            if time.time() - self.refreshed_at < USAGE_REFRESH_INTERVAL:
+                return
+            agents_dir = os.path.expanduser('~/.openclaw/agents')
+            seen = set()
+            try:
+                agents = os.listdir(agents_dir)
+            except OSError:
+                agents = []
+            for agent_id in agents:
+                sessions_dir = os.path.join(agents_dir, agent_id, 'sessions')
+                try:
+                    names = os.listdir(sessions_dir)
+                except OSError:
+                    continue
+                for name in names:
+                    # <sessionId>.jsonl 以及重置後保留的 <sessionId>.jsonl.reset.<ts>
+                    if '.jsonl' not in name:
+                        continue
+                    path = os.path.join(sessions_dir, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    seen.add(path)
+                    state = self.files.get(path)
+                    if state is None:
+                        state = self.files[path] = TranscriptUsage(agent_id, name.split('.jsonl')[0])
+                    try:
+                        state.consume(path, st)
+                    except (OSError, sqlite3.Error):
+                        pass
+            for path in list(self.files):
+                if path not in seen:
+                    del self.files[path]
+            try:
+                self.refresh_cron()
+            except sqlite3.Error:
+                pass
+            self.refreshed_at = time.time()
+
+    def refresh_cron(self):
+        cron_path = os.path.expanduser('~/.openclaw/cron/jobs.json')
+        sig = file_signature([cron_path])
+        if sig == self.cron_sig:
+            # jobs.json 未變動：只需採用其他行程記錄到的執行紀錄
+            stored = _shared_cache.get('usage:cron') if _shared_cache is not None else None
+            if stored and stored[1] != self.cron_shared_ts:
+                self.cron_shared_ts = stored[1]
+                self.merge_cron_runs(stored[0])
+            return
+        self.cron_sig = sig
+        try:
+            with open(cron_path, 'r') as f:
+                jobs = json.load(f).get('jobs', [])
+        except (OSError, ValueError):
+            return
+        for job in jobs:
+            state = job.get('state') or {}
+            last_run = state.get('lastRunAtMs')
+            if not last_run:
+                continue
+            self.cron_runs[(job.get('id'), last_run)] = (
+                job.get('agentId', ''), usage_day(last_run),
+                state.get('lastDurationMs') or 0, state.get('lastStatus', ''))
+        if _shared_cache is not None:
+            def merge(stored):
+                self.merge_cron_runs(stored or [])
+                return [[job_id, last_run, *run] for (job_id, last_run), run in self.cron_runs.items()]
+            _shared_cache.update('usage:cron', merge)
+            stored = _shared_cache.get('usage:cron')
+            self.cron_shared_ts = stored[1] if stored else None
+
+    def merge_cron_runs(self, rows):
+        for job_id, last_run, agent_id, day, duration_ms, status in rows:
+            self.cron_runs.setdefault((job_id, last_run), (agent_id, day, duration_ms, status))
+
+    def query(self, group_by, filters=None, start=None, end=None, sources=None):
+        """依 group_by 維度加總；filters: {維度: [值, ...]}，start/end: 日期範圍 (含)"""
+        filters = filters or {}
+        sources = sources or {}
+        rows = {}
+        totals = dict.fromkeys(USAGE_COUNTERS, 0)
+        cron_rows = {}
+        cron_totals = dict.fromkeys(CRON_COUNTERS, 0)
+        
+        def selected(dims):
+            if start and dims['day'] < start or end and dims['day'] > end:
+                return False
+            return all(dims[k] in v for k, v in filters.items() if k in dims)
+        
+        with self._lock:
+            for state in self.files.values():
+                source = sources.get(state.session_id, 'unknown')
+                for (day, model), counters in state.buckets.items():
+                    dims = {'agentId': state.agent_id, 'model': model, 'source': source, 'day': day}
+                    if not selected(dims):
+                        continue
+                    key = tuple(dims[g] for g in group_by)
+                    row = rows.get(key)
+                    if row is None:
+                        row = rows[key] = dict(zip(group_by, key), **dict.fromkeys(USAGE_COUNTERS, 0))
+                    for c in USAGE_COUNTERS:
+                        row[c] += counters[c]
+                        totals[c] += counters[c]
+            # cron 只有 agentId / day 兩個維度；以模型或來源篩選時不計入
+            if not any(k in filters for k in ('model', 'source')):
+                cron_group = [g for g in group_by if g in ('agentId', 'day')]
+                for agent_id, day, duration_ms, status in self.cron_runs.values():
+                    dims = {'agentId': agent_id, 'day': day}
+                    if not selected(dims):
+                        continue
+                    key = tuple(dims[g] for g in cron_group)
+                    row = cron_rows.get(key)
+                    if row is None:
+                        row = cron_rows[key] = dict(zip(cron_group, key), **dict.fromkeys(CRON_COUNTERS, 0))
+                    for counters in (row, cron_totals):
+                        counters['runs'] += 1
+                        counters['errors'] += 1 if status not in ('ok', '') else 0
+                        counters['durationMs'] += duration_ms
+            bucket_count = sum(len(state.buckets) for state in self.files.values())
+        
+        for counters in list(rows.values()) + [totals]:
+            counters['cost'] = round(counters['cost'], 6)
+        return {
+            "groupBy": list(group_by),
+            "rows": sorted(rows.values(), key=lambda r: (-r['totalTokens'], -r['messages'])),
+            "totals": totals,
+            "cron": sorted(cron_rows.values(), key=lambda r: -r['durationMs']),
+            "cronTotals": cron_totals,
+            "buckets": bucket_count,
+            "updatedAt": int(self.refreshed_at * 1000),
+        }
+
+USAGE = UsageRollup()
+
+def _set_memory_cache(key, entry):
+    _cache.pop(key, None)
+    _cache[key] = entry
+    while len(_cache) > CACHE_MAX_ENTRIES:
+        try:
+            _cache.pop(next(iter(_cache)))
+        except (StopIteration, KeyError, RuntimeError):
+            break
+
 def clear_cache():
     """清除快取"""
     global _cache
     _cache = {}
+    if _shared_cache is not None:
+        try:
+            _shared_cache.clear()
+        except Exception:
+            pass
+
+# ========== 欄位投影 (fields= / include=) ==========
+# 各端點預設不回傳的大型欄位，可用 include= 或在 fields= 中明確列出取回
+PROJECTION_DEFAULT_EXCLUDE = [
+    (re.compile(r'/api/cron'), ['jobs.message']),
+    (re.compile(r'/api/session/[^/]+/messages'), ['offsets']),
+]
+
+def parse_field_paths(values):
+    """'a.b,c' -> {'a': {'b': {}}, 'c': {}}；空 dict 代表整個欄位"""
+    tree = {}
+    for raw in values:
+        for path in raw.split(','):
+            parts = [p for p in path.strip().split('.') if p]
+            node = tree
+            for i, part in enumerate(parts):
+                last = i == len(parts) - 1
+                if part in node and not node[part]:
+                    break  # 已選取整個欄位
+                if last:
+                    node[part] = {}
+                else:
+                    node = node.setdefault(part, {})
+    return tree
+
+def select_fields(data, tree):
+    """只保留 tree 中列出的欄位 (list 會套用到每個元素)"""
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [select_fields(x, tree) for x in data]
+    if isinstance(data, dict):
+        return {k: select_fields(data[k], sub) for k, sub in tree.items() if k in data}
+    return data
+
+def drop_fields(data, tree):
+    """移除 tree 中列出的欄位"""
+    if isinstance(data, list):
+        return [drop_fields(x, tree) for x in data]
+    if not isinstance(data, dict):
+        return data
+    result = {}
+    for k, v in data.items():
+        if k in tree:
+            if not tree[k]:
+                continue
+            v = drop_fields(v, tree[k])
+        result[k] = v
+    return result
+
+def apply_projection(route, params, data):
+    """套用預設排除與 fields= / include=，回傳新的資料 (不修改快取中的原物件)"""
+    fields = [v for k, v in params if k == 'fields']
+    requested = [p.strip() for v in fields + [v for k, v in params if k == 'include'] for p in v.split(',') if p.strip()]
+    
+    def wanted(path):
+        return any(r == '*' or path == r or path.startswith(r + '.') for r in requested)
+    
+    excluded = [path for pattern, paths in PROJECTION_DEFAULT_EXCLUDE if pattern.fullmatch(route)
+                for path in paths if not wanted(path)]
+    if excluded:
+        data = drop_fields(data, parse_field_paths(excluded))
+    if fields:
+        tree = parse_field_paths(fields)
+        tree.setdefault('error', {})  # 錯誤訊息一律保留
+        data = select_fields(data, tree)
+    return data
+
+# 批次 API
+BATCH_PATH = '/api/batch'
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 8
+
+# ========== 附件儲存 (內容定址) ==========
+ATTACHMENTS_PATH = '/api/attachments'
+ATTACHMENT_DIR = os.path.expanduser(os.environ.get('ATTACHMENT_DIR', '~/.openclaw/clawchat/attachments'))
+ATTACHMENT_MAX_BYTES = env_setting('ATTACHMENT_MAX_BYTES')      # 單檔上限
+ATTACHMENT_STORE_BYTES = env_setting('ATTACHMENT_STORE_BYTES')  # 儲存區上限 (LRU 淘汰)
+ATTACHMENT_REF_RE = re.compile(rb'"attachment:([0-9a-f]{64})"')
+ATTACHMENT_MIME_RE = re.compile(r'^image/[a-z0-9.+-]+$')  # 只接受圖片，MIME 會寫入轉發給 Gateway 的 data URL
+_attachment_lock = threading.Lock()
+
+class AttachmentNotFound(Exception):
+    def __init__(self, missing):
+        super().__init__(f"Attachment not found: {', '.join(missing)}")
+        self.missing = missing
+
+def attachment_path(digest):
+    return os.path.join(ATTACHMENT_DIR, digest)
+
+def load_attachment_meta(digest):
+    """讀取附件的 MIME / 大小，不存在時回傳 None"""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest or ''):
+        return None
+    try:
+        with open(attachment_path(digest) + '.json', 'r') as f:
+            meta = json.load(f)
+        if not os.path.isfile(attachment_path(digest)):
+            return None
+        return meta
+    except (OSError, ValueError):
+        return None
+
+def touch_attachment(digest):
+    """更新存取時間 (LRU 依 mtime 淘汰)"""
+    try:
+        os.utime(attachment_path(digest))
+    except OSError:
+        pass
+
+def store_attachment(stream, length, mime):
+    """從 stream 讀取 length bytes，邊算 SHA-256 邊寫入暫存檔，再以雜湊值命名"""
+    import tempfile
+    os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=ATTACHMENT_DIR, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(65536, remaining))
+                if not chunk:
+                    raise ValueError('Incomplete upload')
+                sha.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+        digest = sha.hexdigest()
+        path = attachment_path(digest)
+        deduplicated = os.path.isfile(path)
+        if deduplicated:
+            os.remove(tmp_path)
+            touch_attachment(digest)
+            # 相同內容只存一份，MIME 以第一次上傳時記錄的為準
+            mime = (load_attachment_meta(digest) or {}).get('mime', mime)
+        else:
+            with open(path + '.json', 'w') as f:
+                json.dump({"mime": mime, "size": length, "createdAt": int(time.time() * 1000)}, f)
+            os.replace(tmp_path, path)
+            evict_attachments()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {"ref": f"attachment:{digest}", "id": digest, "size": length, "mime": mime,
+            "deduplicated": deduplicated}
+
+def evict_attachments():
+    """儲存區超過上限時，依最近使用時間淘汰最舊的附件"""
+    with _attachment_lock:
+        files = []
+        total = 0
+        for name in os.listdir(ATTACHMENT_DIR):
+            if not re.fullmatch(r'[0-9a-f]{64}', name):
+                continue
+            try:
+                st = os.stat(os.path.join(ATTACHMENT_DIR, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        files.sort()
+        while total > ATTACHMENT_STORE_BYTES and len(files) > 1:
+            _, size, name = files.pop(0)
+            for suffix in ('', '.json'):
+                try:
+                    os.remove(os.path.join(ATTACHMENT_DIR, name + suffix))
+                except OSError:
+                    pass
+            total -= size
+
+def expand_attachment_refs(body):
+    """把 JSON body 中的 "attachment:<sha256>" 字串展開為 data URL
+
+    回傳 (可迭代的 body, 總長度)：附件內容在送出時才逐塊讀檔並 base64 編碼，
+    記憶體用量與附件大小無關。沒有引用時直接回傳原 body。
+    """
+    matches = list(ATTACHMENT_REF_RE.finditer(body))
+    if not matches:
+        return body, len(body)
+    missing = []
+    parts = []
+    total = 0
+    pos = 0
+    for match in matches:
+        digest = match.group(1).decode()
+        meta = load_attachment_meta(digest)
+        if meta is None:
+            missing.append(digest)
+            continue
+        literal = body[pos:match.start()]
+        mime = meta.get('mime', '')
+        if not ATTACHMENT_MIME_RE.match(mime):
+            mime = 'application/octet-stream'
+        # 以 json.dumps 產生字串開頭，去掉結尾的引號後接上 base64 內容
+        prefix = json.dumps(f'data:{mime};base64,')[:-1].encode()
+        size = os.path.getsize(attachment_path(digest))
+        parts.append((literal + prefix, digest))
+        total += len(literal) + len(prefix) + 4 * ((size + 2) // 3) + 1
+        pos = match.end()
+    if missing:
+        raise AttachmentNotFound(missing)
+    tail = body[pos:]
+    total += len(tail)
+
+    def generate():
+        for head, digest in parts:
+            yield head
+            touch_attachment(digest)
+            with open(attachment_path(digest), 'rb') as f:
+                while True:
+                    chunk = f.read(48 * 1024)  # 3 的倍數，分段編碼結果可直接串接
+                    if not chunk:
+                        break
+                    yield base64.b64encode(chunk)
+            yield b'"'
+        yield tail
+
+    return generate(), total
+
+# ========== Gateway 轉發與斷路器 ==========
+GATEWAY_CONNECT_TIMEOUT = env_setting('GATEWAY_CONNECT_TIMEOUT')        # 建立連線
+GATEWAY_FIRST_BYTE_TIMEOUT = env_setting('GATEWAY_FIRST_BYTE_TIMEOUT')  # 送出請求到收到回應標頭
+GATEWAY_IDLE_TIMEOUT = env_setting('GATEWAY_IDLE_TIMEOUT')              # 回應中兩次收到資料的間隔
+GATEWAY_FAILURE_THRESHOLD = env_setting('GATEWAY_FAILURE_THRESHOLD')    # 連續失敗幾次後斷路
+GATEWAY_OPEN_SECONDS = 5        # 斷路後第一次探測前的等待時間
+GATEWAY_OPEN_MAX_SECONDS = 60   # 探測失敗時等待時間加倍的上限
+
+class GatewayUnavailable(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Gateway unavailable (circuit open)')
+        self.retry_after = retry_after
+
+class GatewayCircuitBreaker:
+    """Gateway 斷路器
+
+    closed：正常轉發；連線錯誤、逾時、5xx 連續達 GATEWAY_FAILURE_THRESHOLD 次即 open。
+    open：直接回 503 與 Retry-After，由背景執行緒探測 (half-open)；探測成功恢復 closed，
+    失敗則等待時間加倍 (上限 GATEWAY_OPEN_MAX_SECONDS)。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0           # 連續失敗次數
+        self.open_seconds = GATEWAY_OPEN_SECONDS
+        self.retry_at = 0
+        self.opened_at = None
+        self.last_error = ''
+        self.latency_ms = None      # 首位元組時間的移動平均
+
+    def before_request(self):
+        """可轉發時回傳 0，否則回傳建議的重試秒數"""
+        with self._lock:
+            if self.state == 'closed':
+                return 0
+            return max(1, int(self.retry_at - time.time() + 0.999))
+
+    def record_success(self, elapsed):
+        with self._lock:
+            self.failures = 0
+            ms = elapsed * 1000
+            self.latency_ms = ms if self.latency_ms is None else self.latency_ms * 0.8 + ms * 0.2
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) or error.__class__.__name__
+            if self.state != 'closed' or self.failures < GATEWAY_FAILURE_THRESHOLD:
+                return
+            self.state = 'open'
+            self.opened_at = time.time()
+            self.open_seconds = GATEWAY_OPEN_SECONDS
+            self.retry_at = time.time() + self.open_seconds
+        print(f"⚠️ Gateway circuit open: {self.last_error}")
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(max(0, self.retry_at - time.time()))
+            with self._lock:
+                self.state = 'half_open'
+            error = probe_gateway()
+            with self._lock:
+                if error is None:
+                    self.state = 'closed'
+                    self.failures = 0
+                    self.opened_at = None
+                    print("✅ Gateway circuit closed")
+                    return
+                self.last_error = error
+                self.state = 'open'
+                self.open_seconds = min(self.open_seconds * 2, GATEWAY_OPEN_MAX_SECONDS)
+                self.retry_at = time.time() + self.open_seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retryAfter": max(0, int(self.retry_at - time.time() + 0.999)) if self.state != 'closed' else 0,
+                "openedAt": int(self.opened_at * 1000) if self.opened_at else None,
+                "lastError": self.last_error,
+                "latencyMs": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            }
+
+GATEWAY_BREAKER = GatewayCircuitBreaker()
+
+def gateway_connection(url, first_byte_timeout):
+    """建立到 Gateway 的連線 (連線逾時與首位元組逾時分開設定)，回傳 (connection, socket, path)"""
+    import urllib.parse
+    parsed = urllib.parse.urlsplit(url)
+    conn_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    conn = conn_class(parsed.hostname, parsed.port, timeout=GATEWAY_CONNECT_TIMEOUT)
+    conn.connect()
+    conn.sock.settimeout(first_byte_timeout)
+    path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+    return conn, conn.sock, path
+
+def probe_gateway():
+    """half-open 探測：能連線且回應非 5xx 即視為恢復，回傳錯誤訊息或 None"""
+    conn = None
+    try:
+        conn, _, _ = gateway_connection(GATEWAY_URL, GATEWAY_CONNECT_TIMEOUT)
+        conn.request('GET', '/', headers={'Authorization': f'Bearer {GATEWAY_TOKEN}'})
+        resp = conn.getresponse()
+        resp.read()
+        return f'HTTP {resp.status}' if resp.status >= 500 else None
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+    finally:
+        if conn is not None:
+            conn.close()
+
+def open_gateway(url, body):
+    """POST 到 Gateway 並回傳回應 (附件引用邊送邊展開)
+
+    斷路時拋出 GatewayUnavailable；4xx/5xx 以 urllib.error.HTTPError 拋出，
+    AttachmentNotFound 等其他例外由呼叫端處理。HTTP 與 WebSocket 轉發共用。
+    回應標頭之後的讀取套用 GATEWAY_IDLE_TIMEOUT，請以 gateway_chunks() 讀取。
+    """
+    retry_after = GATEWAY_BREAKER.before_request()
+    if retry_after:
+        raise GatewayUnavailable(retry_after)
+    data, data_length = expand_attachment_refs(body)
+    started = time.time()
+    conn = None
+    try:
+        conn, sock, path = gateway_connection(url, GATEWAY_FIRST_BYTE_TIMEOUT)
+        conn.request('POST', path, body=data, headers={
+            'Content-Type': 'application/json',
+            'Content-Length': str(data_length),
+            'Authorization': f'Bearer {GATEWAY_TOKEN}',
+            'Origin': '*',
+            'Connection': 'close',  # 連線交給 response，關閉 response 即關閉連線
+        })
+        resp = conn.getresponse()
+        sock.settimeout(GATEWAY_IDLE_TIMEOUT)
+    except Exception as e:
+        if conn is not None:
+            conn.close()
+        GATEWAY_BREAKER.record_failure(e)
+        raise
+    if resp.status >= 500:
+        GATEWAY_BREAKER.record_failure(f'HTTP {resp.status}')
+    else:
+        GATEWAY_BREAKER.record_success(time.time() - started)
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, resp)
+    return resp
+
+def gateway_chunks(resp, size=16384):
+    """逐塊讀取 Gateway 回應 (有資料就回傳，不等湊滿)；讀取逾時或中斷記為 Gateway 失敗"""
+    while True:
+        try:
+            chunk = resp.read1(size)
+        except (OSError, http.client.HTTPException) as e:
+            GATEWAY_BREAKER.record_failure(e)
+            raise
+        if not chunk:
+            return
+        yield chunk
+
+# ========== 留言板 / Backlog 結構化解析 ==========
+SHARED_WORKSPACE = os.path.expanduser('~/.openclaw/workspaces/shared')
+BOARD_POST_RE = re.compile(r'^\s*[-*] \[(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?)\]\s*(.*)$')
+BACKLOG_CARD_RE = re.compile(r'^## \[([^\]]+)\] (.+)$')
+BACKLOG_COLUMNS = [
+    ('todo', ('### 🔵 To Do', '### To Do')),
+    ('inProgress', ('### 🟡 In Progress', '### In Progress')),
+    ('done', ('### ✅ Done', '### Done')),
+]
+BACKLOG_FIELDS = {'提出者': 'author', '日期': 'date', '描述': 'description', '認領者': 'assignee'}
+
+def _split_blocks(text, is_start):
+    """把 markdown 切成區塊：is_start(line) 為真的行開始新區塊，其餘行接到目前區塊"""
+    blocks = []
+    for line in text.split('\n'):
+        if not blocks or is_start(line):
+            blocks.append([line])
+        else:
+            blocks[-1].append(line)
+    return ['\n'.join(lines) for lines in blocks]
+
+def parse_board_entries(text):
+    """解析 BOARD.md：每則 `- [YYYY-MM-DD HH:mm] **作者** 訊息` 為一筆留言，標題與其他段落各為一個區塊"""
+    entries = []
+    for raw in _split_blocks(text, lambda line: line.startswith('#') or BOARD_POST_RE.match(line)):
+        first = raw.split('\n', 1)[0]
+        match = BOARD_POST_RE.match(first)
+        if match:
+            message = match.group(2)
+            author_match = re.match(r'\*\*([^*]+)\*\*\s*(.*)', message)
+            entries.append({
+                "kind": "post",
+                "key": f"post:{first.strip()}",
+                "time": match.group(1),
+                "author": author_match.group(1).strip() if author_match else '',
+                "text": (author_match.group(2) if author_match else message).strip(),
+                "raw": raw,
+            })
+        elif first.startswith('#'):
+            entries.append({
+                "kind": "heading",
+                "key": f"heading:{first.strip()}",
+                "level": len(first) - len(first.lstrip('#')),
+                "title": first.lstrip('#').strip(),
+                "raw": raw,
+            })
+        else:
+            entries.append({"kind": "text", "key": "text", "raw": raw})
+    return entries
+
+def parse_backlog_entries(text):
+    """解析 BACKLOG.md：`### To Do/In Progress/Done` 為欄位，`## [狀態] 標題` 為卡片"""
+    entries = []
+    column = 'todo'
+    for raw in _split_blocks(text, lambda line: line.startswith('### ') or line.startswith('## [')):
+        first = raw.split('\n', 1)[0]
+        for name, markers in BACKLOG_COLUMNS:
+            if any(marker in first for marker in markers):
+                column = name
+                break
+        match = BACKLOG_CARD_RE.match(first)
+        if not match:
+            entries.append({"kind": "text", "key": f"text:{first.strip()}", "column": column, "raw": raw})
+            continue
+        card = {
+            "kind": "card",
+            # 以標題為 key，狀態或欄位改變時視為同一張卡片的更新
+            "key": f"card:{match.group(2).strip()}",
+            "column": column,
+            "status": match.group(1).strip(),
+            "title": match.group(2).strip(),
+            "author": '',
+            "date": '',
+            "description": '',
+            "assignee": '',
+            "raw": raw,
+        }
+        for line in raw.split('\n')[1:]:
+            field = re.match(r'^- \*\*([^*]+)\*\*:\s*(.*)$', line)
+            if field and field.group(1) in BACKLOG_FIELDS:
+                card[BACKLOG_FIELDS[field.group(1)]] = field.group(2).strip()
+        entries.append(card)
+    return entries
+
+class MarkdownIndex:
+    """依 mtime 快取的 markdown 結構化索引，支援 since 游標的增量同步
+
+    version 為檔案的 mtime_ns；每筆 entry 記錄最後一次變動時的 version，
+    被刪除的 entry 記錄刪除時的 version。since 早於本行程首次解析的 version 時回傳完整列表。
+    """
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self._lock = threading.Lock()
+        self.sig = None
+        self.content = ''
+        self.version = 0
+        self.baseline = None
+        self.entries = []
+        self.changed = {}
+        self.hashes = {}
+        self.removed = {}
+
+    def refresh(self):
+        """檔案有變動時重新解析，回傳是否存在"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        sig = (st.st_mtime_ns, st.st_size)
+        if sig == self.sig:
+            return True
+        with self._lock:
+            if sig == self.sig:
+                return True
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            version = max(st.st_mtime_ns, self.version + 1)
+            entries = []
+            hashes = {}
+            changed = {}
+            seen = {}
+            for entry in self.parser(content):
+                key = entry.pop('key')
+                seen[key] = seen.get(key, 0) + 1
+                if seen[key] > 1:
+                    key = f"{key}#{seen[key]}"
+                entry_id = hashlib.sha1(key.encode()).hexdigest()[:12]
+                # 位置變動由 order 表示；結尾空行隨後續內容移動，都不算內容變動
+                digest = hashlib.sha1(json.dumps(dict(entry, raw=entry['raw'].rstrip()),
+                                                 ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+                entry = dict(entry, id=entry_id, index=len(entries))
+                hashes[entry_id] = digest
+                changed[entry_id] = version if self.hashes.get(entry_id) != digest else self.changed[entry_id]
+                entries.append(entry)
+            removed = {k: v for k, v in self.removed.items() if k not in hashes}
+            for entry_id in self.hashes:
+                if entry_id not in hashes:
+                    removed[entry_id] = version
+            if self.baseline is None:
+                self.baseline = version
+            self.content, self.entries, self.hashes, self.changed, self.removed = content, entries, hashes, changed, removed
+            self.version = version
+            self.sig = sig
+        return True
+
+    def query(self, since=None):
+        """取得 entries；since 為上次同步的 version 時只回傳之後新增或變動的部分"""
+        with self._lock:
+            entries, changed, removed, version, baseline = self.entries, self.changed, self.removed, self.version, self.baseline
+        try:
+            since = int(since) if since not in (None, '') else None
+        except ValueError:
+            since = None
+        full = since is None or baseline is None or since < baseline
+        result = {
+            "version": str(version),
+            "full": full,
+            "count": len(entries),
+            "order": [e['id'] for e in entries],
+        }
+        if full:
+            result["entries"] = entries
+            result["removed"] = []
+        else:
+            result["entries"] = [e for e in entries if changed[e['id']] > since]
+            result["removed"] = [k for k, v in removed.items() if v > since]
+        return result
+
+BOARD_INDEX = MarkdownIndex(os.path.join(SHARED_WORKSPACE, 'BOARD.md'), parse_board_entries)
+BACKLOG_INDEX = MarkdownIndex(os.path.join(SHARED_WORKSPACE, 'BACKLOG.md'), parse_backlog_entries)
+
+# ========== 靜態資源快取 ==========
+STATIC_CACHE_MAX_FILE = 8 * 1024 * 1024  # 超過此大小的檔案不快取，直接由 SimpleHTTPRequestHandler 處理
+STATIC_PRELOAD = ['index.html', 'lib']    # 啟動時預先載入 (相對於 SCRIPT_DIR)
+STATIC_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+HASHED_ASSET_RE = re.compile(r'[.-]([0-9a-f]{8,})\.[A-Za-z0-9]+$')  # 檔名含內容雜湊，如 app.3f9a1c2e.js
+STATIC_REF_RE = re.compile(rb'((?:src|href)=")((?:\./)?lib/[^"?#]+)(")')  # HTML 中引用 lib/ 的網址
+
+def is_public_static(path):
+    """只公開 STATIC_PRELOAD 列出的檔案與目錄 (.env、server.py、快取檔等不可下載)"""
+    rel = os.path.relpath(path, SCRIPT_DIR)
+    if any(part.startswith('.') for part in rel.split(os.sep)):
+        return False
+    return any(rel == entry or rel.startswith(entry + os.sep) for entry in STATIC_PRELOAD)
+
+try:
+    import brotli  # 可選，未安裝時只提供 gzip
+except ImportError:
+    brotli = None
+
+class StaticAsset:
+    """記憶體中的靜態檔案：原始內容、預先壓縮的版本與各版本的 ETag (強驗證器需依編碼區分)
+
+    deps 為內容中引用的其他檔案 (path, mtime_ns, size)，任一變更時需重新載入。
+    """
+    def __init__(self, path, mime, data, st, deps=()):
+        import gzip
+        self.mime = mime
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.deps = list(deps)
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        self.digest = digest
+        self.version = digest[:12]  # 網址上的 ?v=，與內容一致時才可視為 immutable
+        self.variants = {'identity': data}
+        if mime.startswith(STATIC_COMPRESSIBLE) and len(data) > 256:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data)
+                if len(compressed) < len(data):
+                    self.variants['br'] = compressed
+        self.etags = {encoding: f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+                      for encoding in self.variants}
+
+    def is_immutable(self, route, query):
+        """?v= 或檔名中的雜湊與實際內容相符時，網址內容不會再變，可長期快取"""
+        versions = [q[2:] for q in query.split('&') if q.startswith('v=')]
+        if any(len(v) >= 8 and self.digest.startswith(v) for v in versions):
+            return True
+        match = HASHED_ASSET_RE.search(route)
+        return bool(match) and self.digest.startswith(match.group(1)[:32])
+
+    def select(self, accept_encoding):
+        """依 Accept-Encoding 選擇壓縮格式 (br > gzip > identity)"""
+        accepted = set()
+        for part in (accept_encoding or '').split(','):
+            name, _, params = part.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding, self.variants[encoding]
+        return 'identity', self.variants['identity']
+
+class StaticAssetCache:
+    """靜態檔案的記憶體快取；每次請求以 stat 比對 mtime/size，檔案變更時自動重新載入"""
+    def __init__(self):
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path) or st.st_size > STATIC_CACHE_MAX_FILE:
+            return None
+        asset = self._assets.get(path)
+        if asset and asset.mtime_ns == st.st_mtime_ns and asset.size == st.st_size and \
+                all(self._unchanged(*dep) for dep in asset.deps):
+            return asset
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        import mimetypes
+        mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        deps = []
+        if mime == 'text/html':
+            data = self._version_refs(path, data, deps)
+        asset = StaticAsset(path, mime, data, st, deps)
+        with self._lock:
+            self._assets[path] = asset
+        return asset
+
+    @staticmethod
+    def _unchanged(path, mtime_ns, size):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return mtime_ns is None
+        return st.st_mtime_ns == mtime_ns and st.st_size == size
+
+    def _version_refs(self, path, data, deps):
+        """在 HTML 引用的 lib/ 網址加上 ?v=<內容雜湊>，讓這些檔案可以 immutable 快取"""
+        base = os.path.dirname(path)
+
+        def replace(match):
+            ref = os.path.normpath(os.path.join(base, match.group(2).decode()))
+            asset = self.get(ref)
+            try:
+                st = os.stat(ref)
+                deps.append((ref, st.st_mtime_ns, st.st_size))
+            except OSError:
+                deps.append((ref, None, None))
+            if asset is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + b'?v=' + asset.version.encode() + match.group(3)
+
+        return STATIC_REF_RE.sub(replace, data)
+
+    def preload(self, root, names):
+        """預先載入檔案與目錄 (fork 前載入可讓 worker 共用記憶體)"""
+        for name in names:
+            path = os.path.join(root, name)
+            paths = [path]
+            if os.path.isdir(path):
+                paths = [os.path.join(d, f) for d, _, files in os.walk(path) for f in files]
+            for p in paths:
+                self.get(p)
+
+STATIC_ASSETS = StaticAssetCache()
+
+# ========== 線上效能分析 ==========
+PROFILE_PATH = '/api/admin/profile'
+PROFILE_MAX_SECONDS = 600  # 單次分析最長時間
+PROFILE_COLLECT_TIMEOUT = 3  # 多行程模式下等待各 worker 回報結果的上限 (秒)
+PROFILE_DEFAULT_MODE = 'sample'  # 未指定 mode 時使用 (開銷低，適合線上流量)
+PROFILE_SAMPLE_INTERVAL = 0.005  # sample 模式預設取樣間隔 (秒)
+
+class _StatsHolder:
+    """讓 pstats.Stats 可由 stats dict 建立 (合併各 worker 的 cProfile 結果)"""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def merge_profile_snapshots(snapshots):
+    """合併各 worker 的 RequestProfiler.snapshot()"""
+    statuses = [snap['status'] for snap in snapshots]
+    status = dict(statuses[0])
+    for key in ('remainingRequests', 'profiledRequests', 'skippedRequests'):
+        status[key] = sum(st.get(key) or 0 for st in statuses)
+    status['active'] = any(st['active'] for st in statuses)
+    status['secondsLeft'] = max(st['secondsLeft'] for st in statuses)
+    status['workers'] = len(snapshots)
+    merged = {"status": status, "samples": sum(snap['samples'] for snap in snapshots), "stats": None}
+    for name in ('selfCounts', 'cumCounts'):
+        counts = {}
+        for snap in snapshots:
+            for filename, line, func, count in snap[name]:
+                counts[(filename, line, func)] = counts.get((filename, line, func), 0) + count
+        merged[name] = [[*key, count] for key, count in counts.items()]
+    stats = [snap['stats'] for snap in snapshots if snap['stats']]
+    if stats:
+        combined = pstats.Stats(_StatsHolder(stats[0]))
+        for extra in stats[1:]:
+            combined.add(_StatsHolder(extra))
+        merged['stats'] = combined.stats
+    return merged
+
+class RequestProfiler:
+    """按需啟用的請求效能分析
+
+    mode='cprofile': 以 cProfile 完整記錄接下來的請求 (同一時間只分析一個請求，其餘照常處理)
+    mode='sample':   背景執行緒定期取樣處理中請求的 stack，開銷低，適合線上流量
+
+    多行程模式下 start / stop 寫入共用快取的控制紀錄，由 supervisor 以 SIGUSR1 轉發給所有 worker
+    (requests 平均分配)；讀取結果時各 worker 將 snapshot 寫回共用快取再合併。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cprofile_lock = threading.Lock()
+        self.active = False
+        self.mode = None
+        self.prefix = ''
+        self.remaining = 0
+        self.deadline = 0
+        self.interval = 0.005
+        self.started_at = None
+        self.profiled = 0
+        self.skipped = 0
+        self.stats = None
+        self.samples = 0
+        self.self_counts = {}
+        self.cum_counts = {}
+        self._threads = {}
+        self._generation = 0
+        self._control_id = None
+        self._collect_id = None
+
+    def start(self, mode=PROFILE_DEFAULT_MODE, requests=0, seconds=0, prefix='', interval=PROFILE_SAMPLE_INTERVAL):
+        if mode not in ('cprofile', 'sample'):
+            raise ValueError(f"Unknown mode: {mode}")
+        if requests <= 0 and seconds <= 0:
+            seconds = 30
+        seconds = min(seconds, PROFILE_MAX_SECONDS) if seconds > 0 else PROFILE_MAX_SECONDS
+        with self._lock:
+            self.active = True
+            self.mode = mode
+            self.prefix = prefix
+            self.remaining = requests
+            self.started_at = time.time()
+            self.deadline = self.started_at + seconds
+            self.interval = max(0.001, interval)
+            self.profiled = 0
+            self.skipped = 0
+            self.stats = None
+            self.samples = 0
+            self.self_counts = {}
+            self.cum_counts = {}
+            self._threads = {}
+            self._generation += 1
+            generation = self._generation
+        if mode == 'sample':
+            threading.Thread(target=self._sample_loop, args=(generation,), daemon=True).start()
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            self.active = False
+        return self.status()
+
+    def _claim(self, path):
+        """判斷此請求是否符合分析條件 (尚不扣除剩餘請求數)"""
+        if not self.active or path.startswith(PROFILE_PATH):
+            return False
+        with self._lock:
+            if not self.active:
+                return False
+            if time.time() > self.deadline:
+                self.active = False
+                return False
+            if self.prefix and not path.startswith(self.prefix):
+                return False
+            return True
+
+    def _take(self):
+        """確定要分析此請求時扣除剩餘請求數；已用完則回傳 False"""
+        with self._lock:
+            if not self.active:
+                return False
+            if self.remaining:
+                self.remaining -= 1
+                if self.remaining == 0:
+                    self.active = False
+            self.profiled += 1
+            return True
+
+    @contextlib.contextmanager
+    def request(self, path):
+        if not self._claim(path):
+            yield
+            return
+        if self.mode == 'sample':
+            if not self._take():
+                yield
+                return
+            ident = threading.get_ident()
+            self._threads[ident] = path
+            try:
+                yield
+            finally:
+                self._threads.pop(ident, None)
+            return
+        # cProfile 無法在多個執行緒同時啟用，忙碌時直接略過 (不計入 requests)
+        if not self._cprofile_lock.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            yield
+            return
+        if not self._take():
+            self._cprofile_lock.release()
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+            with self._lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+        finally:
+            self._cprofile_lock.release()
+
+    def _sample_loop(self, generation):
+        own = threading.get_ident()
+        # 請求數用完後仍需取樣到最後一個請求結束
+        while ((self.active or self._threads) and time.time() <= self.deadline
+               and generation == self._generation):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in list(self._threads):
+                    frame = frames.get(ident)
+                    if frame is None or ident == own:
+                        continue
+                    seen = set()
+                    leaf = True
+                    while frame is not None:
+                        code = frame.f_code
+                        key = (code.co_filename, code.co_firstlineno, code.co_name)
+                        if leaf:
+                            self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                            leaf = False
+                        if key not in seen:
+                            seen.add(key)
+                            self.cum_counts[key] = self.cum_counts.get(key, 0) + 1
+                        frame = frame.f_back
+                    self.samples += 1
+            del frames
+            time.sleep(self.interval)
+        if generation == self._generation:
+            self.active = False
+
+    def status(self):
+        return {
+            "active": self.active,
+            "mode": self.mode,
+            "prefix": self.prefix,
+            "remainingRequests": self.remaining,
+            "secondsLeft": max(0, round(self.deadline - time.time(), 1)) if self.active else 0,
+            "startedAt": self.started_at,
+            "profiledRequests": self.profiled,
+            "skippedRequests": self.skipped,
+        }
+
+    def snapshot(self):
+        """本行程的分析結果 (可合併)"""
+        with self._lock:
+            return {
+                "status": self.status(),
+                "samples": self.samples,
+                "selfCounts": [[*key, count] for key, count in self.self_counts.items()],
+                "cumCounts": [[*key, count] for key, count in self.cum_counts.items()],
+                "stats": dict(self.stats.stats) if self.stats is not None else None,
+            }
+
+    def control(self, action, **params):
+        """多行程模式：寫入控制紀錄，本 worker 立即套用，並請 supervisor 通知其他 worker"""
+        _shared_cache.set('profile:control', {"id": f"{os.getpid()}-{time.time()}", "action": action,
+                                              "params": params}, time.time())
+        self.apply_control()
+        os.kill(os.getppid(), signal.SIGUSR1)
+        return self.status()
+
+    def apply_control(self):
+        """SIGUSR1：套用共用快取中新的控制紀錄，並回報結果收集請求"""
+        if _shared_cache is None:
+            return
+        stored = _shared_cache.get('profile:control')
+        if stored and stored[0]['id'] != self._control_id:
+            record = stored[0]
+            self._control_id = record['id']
+            if record['action'] == 'start':
+                params = dict(record['params'])
+                if params.get('requests'):
+                    params['requests'] = -(-params['requests'] // WORKERS)
+                self.start(**params)
+            else:
+                self.stop()
+        stored = _shared_cache.get('profile:collect')
+        if stored and stored[0] != self._collect_id:
+            self._collect_id = stored[0]
+            self._publish(stored[0])
+
+    def _publish(self, collect_id):
+        import marshal
+        snap = self.snapshot()
+        if snap['stats'] is not None:
+            snap['stats'] = base64.b64encode(marshal.dumps(snap['stats'])).decode()
+        _shared_cache.set(f'profile:worker:{os.getpid()}', {"collect": collect_id, "snapshot": snap}, time.time())
+
+    def collect(self):
+        """多行程模式：請所有 worker 回報 snapshot 並合併 (逾時則合併已回報的部分)"""
+        import marshal
+        collect_id = f"{os.getpid()}-{time.time()}"
+        _shared_cache.set('profile:collect', collect_id, time.time())
+        self._collect_id = collect_id
+        self._publish(collect_id)
+        os.kill(os.getppid(), signal.SIGUSR1)
+        deadline = time.time() + PROFILE_COLLECT_TIMEOUT
+        while True:
+            snapshots = [value['snapshot'] for _, value in _shared_cache.items('profile:worker:')
+                         if value.get('collect') == collect_id]
+            if len(snapshots) >= WORKERS or time.time() >= deadline:
+                break
+            time.sleep(0.05)
+        for snap in snapshots:
+            if snap['stats'] is not None:
+                snap['stats'] = marshal.loads(base64.b64decode(snap['stats']))
+        return merge_profile_snapshots(snapshots)
+
+    def summary(self, limit=30, snapshot=None):
+        """匯總熱點函式 (snapshot 為合併後的結果，預設為本行程)"""
+        def fmt(key):
+            filename, line, name = key
+            if filename == '~':
+                return name
+            short = os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+            return f"{name} ({short}:{line})"
+
+        snapshot = snapshot or self.snapshot()
+        result = snapshot['status']
+        if result['mode'] == 'sample':
+            samples = snapshot['samples']
+            self_counts = [(tuple(row[:3]), row[3]) for row in snapshot['selfCounts']]
+            cum_counts = [(tuple(row[:3]), row[3]) for row in snapshot['cumCounts']]
+            total = samples or 1
+            result["samples"] = samples
+            result["hotSelf"] = [
+                {"function": fmt(k), "samples": c, "percent": round(c * 100 / total, 1)}
+                for k, c in sorted(self_counts, key=lambda x: -x[1])[:limit]
+            ]
+            result["hotCumulative"] = [
+                {"function": fmt(k), "samples": c, "percent": round(c * 100 / total, 1)}
+                for k, c in sorted(cum_counts, key=lambda x: -x[1])[:limit]
+            ]
+        elif snapshot['stats'] is not None:
+            entries = list(snapshot['stats'].items())
+            rows = [
+                {"function": fmt(k), "calls": nc, "primitiveCalls": cc,
+                 "totalMs": round(tt * 1000, 2), "cumulativeMs": round(ct * 1000, 2)}
+                for k, (cc, nc, tt, ct, _callers) in entries
+            ]
+            result["hotSelf"] = sorted(rows, key=lambda r: -r["totalMs"])[:limit]
+            result["hotCumulative"] = sorted(rows, key=lambda r: -r["cumulativeMs"])[:limit]
+        return result
+
+    def dump_pstats(self, snapshot=None):
+        """輸出 .pstats 檔內容 (僅 cprofile 模式)"""
+        import marshal
+        stats = (snapshot or self.snapshot())['stats']
+        if stats is None:
+            return None
+        return marshal.dumps(stats)
+
+PROFILER = RequestProfiler()
+
+# ========== 對話匯出 ==========
+EXPORT_FORMATS = ('ndjson', 'md', 'zip')
+EXPORT_MAX_SESSIONS = 1000
+EXPORT_BUFFER_SIZE = 64 * 1024
+SESSION_ID_RE = re.compile(r'[A-Za-z0-9][A-Za-z0-9._:-]*')
+
+def find_session_file(session_id):
+    """在各 agent 的 sessions 目錄中尋找 transcript，回傳 (agent_id, 路徑)，找不到回傳 (None, None)"""
+    if not session_id or not SESSION_ID_RE.fullmatch(session_id) or '..' in session_id:
+        return None, None
+    agents_dir = os.path.expanduser('~/.openclaw/agents')
+    try:
+        agents = sorted(os.listdir(agents_dir))
+    except OSError:
+        return None, None
+    for agent_id in agents:
+        path = os.path.join(agents_dir, agent_id, 'sessions', f'{session_id}.jsonl')
+        if os.path.isfile(path):
+            return agent_id, path
+    return None, None
+
+def iter_transcript_lines(path):
+    """逐行讀取 transcript (bytes)，略過仍在寫入中的最後一行"""
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                yield line
+
+def md_fence(text, lang=''):
+    """以不會與內容衝突的 ``` 長度包住程式碼區塊"""
+    fence = '```'
+    while fence in text:
+        fence += '`'
+    return f"{fence}{lang}\n{text}\n{fence}\n\n"
+
+def transcript_markdown(session_id, agent_id, lines):
+    """把 transcript 行轉成 Markdown (逐則產生，不保留整份內容)"""
+    yield f"# {session_id}\n\n- Agent: {agent_id}\n"
+    titles = {'user': '👤 User', 'assistant': '🤖 Assistant', 'toolResult': '🔧 Tool result'}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        kind = entry.get('type')
+        if kind == 'session':
+            yield f"- 建立時間: {entry.get('timestamp', '')}\n"
+            continue
+        if kind == 'model_change':
+            yield f"\n> 模型切換：{entry.get('modelId', '')}\n"
+            continue
+        if kind != 'message':
+            continue
+        msg = entry.get('message') or {}
+        role = msg.get('role', '')
+        meta = ' · '.join(str(v) for v in (entry.get('timestamp'), msg.get('model'), msg.get('toolName')) if v)
+        yield f"\n## {titles.get(role, role)}\n\n" + (f"<sub>{meta}</sub>\n\n" if meta else '')
+        content = msg.get('content')
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for c in content if isinstance(content, list) else []:
+            if not isinstance(c, dict):
+                continue
+            ctype = c.get('type')
+            if ctype == 'text':
+                text = c.get('text', '')
+                yield md_fence(text) if role == 'toolResult' else text + '\n\n'
+            elif ctype == 'thinking':
+                yield f"<details><summary>思考過程</summary>\n\n{c.get('thinking', '')}\n\n</details>\n\n"
+            elif ctype == 'toolCall':
+                args = json.dumps(c.get('arguments', {}), ensure_ascii=False, indent=2)
+                yield f"**🔧 {c.get('name', 'unknown')}**\n\n" + md_fence(args, 'json')
+            elif ctype == 'image':
+                yield f"*[圖片 {c.get('mimeType', '')}]*\n\n"
+
+# ========== WebSocket (多工聊天串流) ==========
+WS_PATH = '/api/ws'
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_MAX_MESSAGE = 32 * 1024 * 1024  # 單則訊息上限 (含內嵌圖片)
+WS_MAX_STREAMS = 8                 # 每條連線同時進行的串流數
+WS_PING_INTERVAL = 30              # 伺服器 ping 間隔；超過兩個間隔沒收到任何 frame 視為斷線
+WS_CHAT_PATHS = ('/v1/chat/completions', '/v1/responses')
+
+class WebSocketClosed(Exception):
+    pass
+
+def ws_unmask(data, mask):
+    n = len(data)
+    if not n:
+        return data
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(n, 'big')
+
+class WebSocketConnection:
+    """RFC 6455 伺服器端連線：由 handler 執行緒讀取，多個串流執行緒透過鎖寫入"""
+    def __init__(self, sock, rfile, wfile):
+        self.sock = sock
+        self.rfile = rfile
+        self.wfile = wfile
+        self._send_lock = threading.Lock()
+        self.closed = False
+        self.last_seen = time.time()
+        self.sessions = set()  # presence：此連線正在檢視的 session
+        self.streams = {}      # request id -> (sessionId, 取消用 Event)
+
+    def _read(self, n):
+        data = self.rfile.read(n)
+        if data is None or len(data) < n:
+            raise WebSocketClosed()
+        return data
+
+    def recv(self):
+        """讀取一則完整訊息 (合併分片)，回傳 (opcode, payload)；ping / close 在此處理"""
+        message = bytearray()
+        message_opcode = None
+        while True:
+            b1, b2 = self._read(2)
+            fin, opcode = b1 & 0x80, b1 & 0x0F
+            if b1 & 0x70 or not b2 & 0x80:
+                self.close(1002)  # 不支援擴充；客戶端 frame 必須遮罩
+                raise WebSocketClosed()
+            length = b2 & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', self._read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._read(8))[0]
+            mask = self._read(4)
+            if len(message) + length > WS_MAX_MESSAGE:
+                self.close(1009)
+                raise WebSocketClosed()
+            payload = ws_unmask(self._read(length), mask)
+            self.last_seen = time.time()
+            if opcode == 0x8:
+                self.close(1000)
+                raise WebSocketClosed()
+            elif opcode == 0x9:
+                self.send_frame(0xA, payload)
+                continue
+            elif opcode == 0xA:
+                continue
+            if (opcode == 0) == (message_opcode is None):
+                self.close(1002)  # 分片順序錯誤
+                raise WebSocketClosed()
+            if opcode:
+                message_opcode = opcode
+            message += payload
+            if fin:
+                return message_opcode, bytes(message)
+
+    def send_frame(self, opcode, payload):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, n)
+        elif n < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+        with self._send_lock:
+            if self.closed:
+                raise WebSocketClosed()
+            try:
+                self.wfile.write(header + payload)
+            except OSError:
+                self.closed = True
+                raise WebSocketClosed()
+
+    def send_json(self, data):
+        self.send_frame(0x1, json.dumps(data, ensure_ascii=False).encode())
+
+    def close(self, code=1000):
+        try:
+            self.send_frame(0x8, struct.pack('!H', code))
+        except WebSocketClosed:
+            pass
+        self.closed = True
+
+    def abort(self):
+        """中斷底層 socket，讓阻塞中的 recv 立即返回"""
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+WS_RELAY_INTERVAL = 0.5  # 多行程模式下輪詢其他 worker 事件的間隔 (秒)
+WS_RELAY_KEEP = 200      # 共用快取中保留的事件數
+
+class WebSocketHub:
+    """目前的 WebSocket 連線，用於 presence 與 session 更新廣播
+
+    多行程模式下經共用快取在 worker 之間轉發：各 worker 將本地的 presence 計數寫入 ws:presence:<pid>
+    (計數為所有存活 worker 的加總)，事件附加到 ws:events，由各 worker 的轉發執行緒輪詢後送給自己的連線。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._presence_lock = threading.Lock()
+        self.connections = set()
+        self._relay_seq = None  # 已處理到的事件序號；None 表示尚未啟動轉發
+
+    def relayed(self):
+        return IN_WORKER and _shared_cache is not None
+
+    def add(self, ws):
+        with self._lock:
+            self.connections.add(ws)
+            start_relay = self.relayed() and self._relay_seq is None
+            if start_relay:
+                self._relay_seq = 0
+        if start_relay:
+            try:
+                stored = _shared_cache.get('ws:events')
+                self._relay_seq = stored[0]['seq'] if stored else 0
+            except sqlite3.Error:
+                pass
+            threading.Thread(target=self._relay_loop, daemon=True).start()
+
+    def remove(self, ws):
+        with self._lock:
+            self.connections.discard(ws)
+        for session_id in list(ws.sessions):
+            self.presence(session_id)
+
+    def broadcast(self, data, session_id=None):
+        """送給本行程的連線 (指定 session_id 時只送給正在檢視該 session 的連線)"""
+        with self._lock:
+            targets = [ws for ws in self.connections if session_id is None or session_id in ws.sessions]
+        for ws in targets:
+            try:
+                ws.send_json(data)
+            except WebSocketClosed:
+                pass
+
+    def publish(self, data):
+        """送給所有連線 (含其他 worker)"""
+        self.broadcast(data)
+        self._append_event('broadcast', data)
+
+    def presence(self, session_id):
+        if self.relayed():
+            with self._presence_lock, self._lock:
+                counts = {}
+                for ws in self.connections:
+                    for sid in ws.sessions:
+                        counts.setdefault(sid, [0, 0])[0] += 1
+                    for sid, _ in list(ws.streams.values()):
+                        if sid:
+                            counts.setdefault(sid, [0, 0])[1] += 1
+                try:
+                    _shared_cache.set(f'ws:presence:{os.getpid()}', counts, time.time())
+                except sqlite3.Error:
+                    pass
+            self._append_event('presence', session_id)
+        self._send_presence(session_id)
+
+    def _send_presence(self, session_id):
+        viewers = streaming = 0
+        if self.relayed():
+            try:
+                records = _shared_cache.items('ws:presence:')
+            except sqlite3.Error:
+                records = []
+            for key, counts in records:
+                pid = int(key.rsplit(':', 1)[1])
+                if pid != os.getpid():
+                    try:
+                        os.kill(pid, 0)  # 略過已結束的 worker 留下的紀錄
+                    except ProcessLookupError:
+                        continue
+                    except OSError:
+                        pass
+                viewers += counts.get(session_id, [0, 0])[0]
+                streaming += counts.get(session_id, [0, 0])[1]
+        else:
+            with self._lock:
+                viewers = sum(1 for ws in self.connections if session_id in ws.sessions)
+                streaming = sum(1 for ws in self.connections for sid, _ in list(ws.streams.values()) if sid == session_id)
+        self.broadcast({"type": "presence", "sessionId": session_id, "clients": viewers, "streaming": streaming},
+                       session_id=session_id)
+
+    def _append_event(self, kind, data):
+        if not self.relayed():
+            return
+        pid = os.getpid()
+
+        def append(log):
+            log = log or {"seq": 0, "events": []}
+            seq = log['seq'] + 1
+            return {"seq": seq, "events": (log['events'] + [[seq, pid, kind, data]])[-WS_RELAY_KEEP:]}
+        try:
+            _shared_cache.update('ws:events', append)
+        except sqlite3.Error:
+            pass
+
+    def _relay_loop(self):
+        """轉發其他 worker 的事件給本行程的連線"""
+        pid = os.getpid()
+        while True:
+            time.sleep(WS_RELAY_INTERVAL)
+            try:
+                stored = _shared_cache.get('ws:events')
+            except sqlite3.Error:
+                continue
+            if not stored:
+                continue
+            log = stored[0]
+            if log['seq'] < self._relay_seq:  # 共用快取被清除後序號重新開始
+                self._relay_seq = log['seq']
+            for seq, source, kind, data in log['events']:
+                if seq <= self._relay_seq or source == pid:
+                    continue
+                if kind == 'presence':
+                    self._send_presence(data)
+                else:
+                    self.broadcast(data)
+            self._relay_seq = log['seq']
+
+    def close_idle(self, code=1012):
+        """關閉沒有進行中串流的連線 (1012 Service Restart：客戶端可立即重連到新行程)"""
+        with self._lock:
+            targets = [ws for ws in self.connections if not ws.streams]
+        for ws in targets:
+            ws.close(code)
+            ws.abort()
+
+WS_HUB = WebSocketHub()
+
+# ========== HTTP/1.1 keep-alive ==========
+KEEPALIVE_TIMEOUT = env_setting('KEEPALIVE_TIMEOUT')            # 連線閒置多久後關閉 (秒)
+KEEPALIVE_MAX_REQUESTS = env_setting('KEEPALIVE_MAX_REQUESTS')  # 每條連線最多處理的請求數
+BODY_DISCARD_MAX = 64 * 1024  # 未讀取的 request body 在此大小內直接丟棄並保留連線，否則關閉連線
+
+class ConnectionTracker:
+    """目前的連線狀態：處理中的請求數與閒置的 keep-alive 連線，優雅停止時據此排空"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.idle = set()       # 等待下一個請求的連線 socket
+        self.active = 0         # 處理中的請求 (含 SSE 串流與 WebSocket 連線)
+        self.draining = False
+
+    def _close(self, sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def opened(self, sock):
+        with self._lock:
+            if not self.draining:
+                self.idle.add(sock)
+                return
+        self._close(sock)
+
+    def closed(self, sock):
+        with self._lock:
+            self.idle.discard(sock)
+
+    def begin(self, sock):
+        with self._lock:
+            self.idle.discard(sock)
+            self.active += 1
+
+    def end(self, sock, keep_alive):
+        with self._lock:
+            self.active -= 1
+            if not keep_alive:
+                return
+            if not self.draining:
+                self.idle.add(sock)
+                return
+        self._close(sock)
+
+    def drain(self, deadline):
+        """停止保留閒置連線並等待處理中的請求完成；逾時回傳 False"""
+        with self._lock:
+            self.draining = True
+            idle, self.idle = list(self.idle), set()
+        for sock in idle:
+            self._close(sock)
+        while True:
+            WS_HUB.close_idle()
+            with self._lock:
+                if not self.active:
+                    return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.2)
+
+CONNECTIONS = ConnectionTracker()
+
+class ChunkedWriter:
+    """以 Transfer-Encoding: chunked 寫出長度未知的回應；HTTP/1.0 客戶端則直接寫出並於結束時關閉連線
+
+    buffer_size > 0 時先累積再送出，避免大量零碎的小 chunk (例如 zipfile 的逐欄位寫入)。
+    """
+    def __init__(self, wfile, chunked=True, buffer_size=0):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self._buffer = bytearray()
+
+    def write(self, data):
+        if self.buffer_size:
+            self._buffer += data
+            if len(self._buffer) >= self.buffer_size:
+                self._send(bytes(self._buffer))
+                self._buffer.clear()
+        else:
+            self._send(data)
+        return len(data)
+
+    def _send(self, data):
+        if data:
+            if self.chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            else:
+                self.wfile.write(data)
+
+    def flush(self):
+        if self._buffer:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        self.wfile.flush()
+
+    def close(self):
+        """寫出剩餘資料與結尾的空 chunk"""
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
 
 class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT  # 等待下一個請求 (或讀取 body) 的 socket 逾時
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=SCRIPT_DIR, **kwargs)
         # 取得請求的 Origin
@@ -91,63 +2153,237 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         allowed_origin = get_allowed_origin(self._request_origin)
         if allowed_origin:
             self.send_header('Access-Control-Allow-Origin', allowed_origin)
+        # keep-alive：告知剩餘可用次數，達到上限或準備停止時關閉連線
+        if not self.close_connection:
+            served = getattr(self, '_requests_served', 1)
+            if served >= KEEPALIVE_MAX_REQUESTS or CONNECTIONS.draining:
+                self.send_header('Connection', 'close')
+            else:
+                if self.request_version == 'HTTP/1.0':
+                    self.send_header('Connection', 'keep-alive')
+                self.send_header('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}, max={KEEPALIVE_MAX_REQUESTS - served}')
         super().end_headers()
     
+    def handle(self):
+        CONNECTIONS.opened(self.connection)
+        try:
+            super().handle()
+        finally:
+            CONNECTIONS.closed(self.connection)
+    
+    def handle_one_request(self):
+        # 注意：handle() 在 __init__ 內執行，計數不能放在 __init__ 初始化
+        self._requests_served = getattr(self, '_requests_served', 0) + 1
+        self._busy = False
+        self._body_unread = 0
+        try:
+            super().handle_one_request()
+        finally:
+            # 未讀取的 request body 會殘留在 keep-alive 連線中被當成下一個請求：小的直接丟棄，大的關閉連線
+            if self._body_unread and not self.close_connection:
+                try:
+                    if self._body_unread > BODY_DISCARD_MAX:
+                        self.close_connection = True
+                    else:
+                        self.rfile.read(self._body_unread)
+                except OSError:
+                    self.close_connection = True
+                self._body_unread = 0
+            if self._busy:
+                CONNECTIONS.end(self.connection, not self.close_connection)
+    
+    def parse_request(self):
+        # 已讀到請求行：從閒置連線轉為處理中
+        self._busy = True
+        CONNECTIONS.begin(self.connection)
+        if not super().parse_request():
+            return False
+        try:
+            self._body_unread = max(0, int(self.headers.get('Content-Length', 0)))
+        except ValueError:
+            self.close_connection = True
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            # 不支援 chunked request body，回應後關閉連線
+            self.close_connection = True
+        return True
+    
+    def read_body(self):
+        """讀取整個 request body (依 Content-Length)"""
+        data = self.rfile.read(self._body_unread) if self._body_unread else b''
+        self._body_unread = 0
+        return data
+    
+    def start_chunked(self, status, content_type, headers=None, buffer_size=0):
+        """送出長度未知的回應標頭，回傳 ChunkedWriter"""
+        chunked = self.request_version != 'HTTP/1.0'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked, buffer_size)
+    
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Content-Length', '0')
         self.end_headers()
     
     def do_GET(self):
+        with PROFILER.request(self.path):
+            self._do_GET()
+    
+    def do_POST(self):
+        with PROFILER.request(self.path):
+            self._do_POST()
+    
+    def do_HEAD(self):
+        if self.path.startswith(ATTACHMENTS_PATH + '/'):
+            self.handle_attachment_get(head=True)
+        else:
+            self.serve_static(head=True)
+    
+    def _do_GET(self):
         # 每次請求更新 Origin
         self._request_origin = self.headers.get('Origin', '')
         
         # 敏感端點需要 API Key 認證
-        sensitive_paths = ['/api/channels', '/api/config', '/api/board', '/api/cron', '/api/backlog']
-        needs_auth = any(self.path.startswith(p) for p in sensitive_paths)
-        
-        if needs_auth and not check_api_key(self.headers):
+        if needs_api_key(self.path) and not check_api_key(self.headers):
             self.send_error(401, 'Unauthorized')
             return
         
-        if self.path == '/api/status':
-            self.send_json_response(self.get_status())
-        elif self.path == '/api/agents':
-            self.send_json_response(self.get_agents())
-        elif self.path == '/api/channels':
-            self.send_json_response(self.get_channels())
-        elif self.path == '/api/config':
-            self.send_json_response(self.get_config())
-        elif self.path.startswith('/api/sessions'):
-            self.send_json_response(self.get_sessions())
-        elif self.path.startswith('/api/session/'):
-            # /api/session/<session_id>/messages
-            parts = self.path.split('/')
+        if self.path.startswith(PROFILE_PATH):
+            self.handle_profile_request()
+        elif self.path.startswith(BATCH_PATH):
+            self.handle_batch_request()
+        elif self.path.startswith(ATTACHMENTS_PATH + '/'):
+            self.handle_attachment_get()
+        elif self.path == '/api/ngrok/start':
+            self.send_json_response(self.start_ngrok())
+        elif self.path.split('?', 1)[0] == WS_PATH:
+            self.handle_websocket()
+        elif self.path.split('?', 1)[0] == '/api/sessions/export' or \
+                (self.path.startswith('/api/session/') and self.path.split('?', 1)[0].endswith('/export')):
+            # 需在 route_api_get 之前處理 (/api/sessions 以前綴比對)
+            self.handle_session_export()
+        else:
+            data = self.route_api_get(self.path)
+            if data is None:
+                self.serve_static()
+            else:
+                self.send_json_response(data)
+    
+    def serve_static(self, head=False):
+        """從記憶體快取提供靜態檔案 (ETag / 預先壓縮)；過大的檔案交回 SimpleHTTPRequestHandler
+
+        只提供 index.html 與 lib/ 下的檔案，其餘 (含目錄列表) 一律 404。
+        """
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if not is_public_static(path) or not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return
+        asset = STATIC_ASSETS.get(path)
+        if asset is None:
+            if head:
+                super().do_HEAD()
+            else:
+                super().do_GET()
+            return
+        
+        route, _, query = self.path.partition('?')
+        if asset.is_immutable(route, query):
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'no-cache'  # 每次以 ETag 重新驗證
+        
+        encoding, body = asset.select(self.headers.get('Accept-Encoding'))
+        etag = asset.etags[encoding]
+        # 任一編碼版本的 ETag 相符都代表內容未變
+        if_none_match = self.headers.get('If-None-Match', '')
+        if if_none_match and (if_none_match.strip() == '*' or
+                              set(asset.etags.values()) & {t.strip().removeprefix('W/') for t in if_none_match.split(',')}):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', asset.mime)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.date_time_string(asset.mtime))
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+    
+    def route_api_get(self, path):
+        """GET API 路由，回傳 JSON 資料；非 API 路徑回傳 None (供 do_GET 與 /api/batch 共用)
+
+        fields= / include= 在此統一處理：先從查詢字串移除再交給各端點，回傳後套用投影。
+        """
+        import urllib.parse
+        route, _, qs = path.partition('?')
+        params = urllib.parse.parse_qsl(qs, keep_blank_values=True)
+        rest = [(k, v) for k, v in params if k not in ('fields', 'include')]
+        if len(rest) != len(params):
+            path = route + ('?' + urllib.parse.urlencode(rest) if rest else '')
+        data = self.dispatch_api_get(path)
+        if isinstance(data, dict):
+            data = apply_projection(route, params, data)
+        return data
+    
+    def dispatch_api_get(self, path):
+        route = path.split('?', 1)[0]
+        if path == '/api/status':
+            return self.get_status()
+        elif path == '/api/agents':
+            return self.get_agents()
+        elif path == '/api/channels':
+            return self.get_channels()
+        elif path == '/api/config':
+            return self.get_config()
+        elif path.startswith('/api/sessions'):
+            return self.get_sessions(path)
+        elif path.startswith('/api/session/'):
+            # /api/session/<session_id>/messages[/<message_id>]
+            parts = route.split('/')
+            if len(parts) == 6 and parts[4] == 'messages':
+                return self.get_session_message_detail(parts[3], parts[5])
             if len(parts) >= 5 and parts[4] == 'messages':
                 session_id = parts[3]
-                self.send_json_response(self.get_session_messages(session_id))
+                return self.get_session_messages(session_id)
             else:
-                self.send_json_response({"error": "Invalid path"})
-        elif self.path.startswith('/api/agent/'):
-            parts = self.path.split('/')
+                return {"error": "Invalid path"}
+        elif path.startswith('/api/agent/'):
+            parts = path.split('/')
             # parts: ['', 'api', 'agent', '<agent_id>', 'files', ...]
             agent_id = parts[3] if len(parts) > 3 else None
             if not agent_id:
-                self.send_json_response({"error": "Missing agent ID"})
-                return
+                return {"error": "Missing agent ID"}
             
             if len(parts) > 4 and parts[4].startswith('files'):
                 # 取得 query string 中的 path 參數
                 file_path = ''
-                if '?' in self.path:
+                if '?' in path:
                     from urllib.parse import parse_qs, urlparse
-                    parsed = urlparse(self.path)
+                    parsed = urlparse(path)
                     file_path = parse_qs(parsed.query).get('path', [''])[0]
                 
                 if file_path:
                     # 檢查是檔案還是目錄
-                    import os
                     workspace = None
                     with open(CONFIG_PATH, 'r') as f:
                         config = json.load(f)
@@ -161,41 +2397,107 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                         full_path = os.path.join(workspace, file_path)
                         if os.path.isdir(full_path):
                             # 是目錄，列出內容
-                            self.send_json_response(self.list_agent_files(agent_id, file_path))
+                            return self.list_agent_files(agent_id, file_path)
                         elif os.path.isfile(full_path):
                             # 是檔案，讀取內容
-                            self.send_json_response(self.read_agent_file(agent_id, file_path))
+                            return self.read_agent_file(agent_id, file_path)
                         else:
-                            self.send_json_response({"error": "Path not found"})
+                            return {"error": "Path not found"}
                     else:
-                        self.send_json_response({"error": "Workspace not found"})
+                        return {"error": "Workspace not found"}
                 else:
                     # 列出所有檔案
-                    self.send_json_response(self.list_agent_files(agent_id))
+                    return self.list_agent_files(agent_id)
             else:
-                self.send_json_response(self.get_agent_detail(agent_id))
-        elif self.path == '/api/ngrok/start':
-            self.send_json_response(self.start_ngrok())
-        elif self.path == '/api/board':
-            self.send_json_response(self.get_board())
-        elif self.path == '/api/backlog':
-            self.send_json_response(self.get_backlog())
-        elif self.path.startswith('/api/board/'):
+                return self.get_agent_detail(agent_id)
+        elif route == '/api/board':
+            return self.get_board(path)
+        elif route == '/api/backlog':
+            return self.get_backlog(path)
+        elif path.startswith('/api/board/'):
             # 讀取留言板相關檔案
-            filename = self.path.replace('/api/board/', '')
-            self.send_board_file(filename)
-        elif self.path == '/api/schedules':
-            self.send_json_response(self.get_schedules())
-        elif self.path == '/api/cron':
-            self.send_json_response(self.get_crons())
+            filename = path.replace('/api/board/', '')
+            return self.get_board_file(filename)
+        elif path == '/api/schedules':
+            return self.get_schedules()
+        elif path == '/api/cron':
+            return self.get_crons()
+        elif route.startswith('/api/cron/'):
+            return self.get_cron_detail(route[len('/api/cron/'):])
+        elif route == '/api/usage':
+            return self.get_usage(path)
+        return None
+    
+    def handle_batch_request(self):
+        """批次請求：一次取得多個 GET 端點，伺服器端並行執行
+
+        POST /api/batch  {"requests": [{"id": "status", "path": "/api/status"}, "/api/agents", ...]}
+        GET  /api/batch?path=/api/status&path=/api/agents
+        加上 ?stream=1 時以 NDJSON 逐筆回傳 (先完成的先送)
+        每個子請求各自套用敏感端點的 API Key 檢查
+        """
+        import urllib.parse
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        stream = query.get('stream', ['0'])[0] in ('1', 'true')
+        if self.command == 'POST':
+            try:
+                body = json.loads(self.read_body() or b'{}')
+            except ValueError:
+                self.send_json_response({"error": "Invalid JSON"}, status=400)
+                return
+            items = body.get('requests', []) if isinstance(body, dict) else body
         else:
-            super().do_GET()
+            items = query.get('path', [])
+        if not isinstance(items, list) or not items:
+            self.send_json_response({"error": "No requests"}, status=400)
+            return
+        if len(items) > BATCH_MAX_REQUESTS:
+            self.send_json_response({"error": f"Too many requests (max {BATCH_MAX_REQUESTS})"}, status=400)
+            return
+        
+        requests = []
+        for i, item in enumerate(items):
+            if isinstance(item, str):
+                item = {"path": item}
+            elif not isinstance(item, dict):
+                item = {}
+            path = str(item.get('path', ''))
+            requests.append({"id": item.get('id', path or i), "path": path})
+        
+        def run_one(req):
+            path = req['path']
+            result = {"id": req['id'], "path": path}
+            if (not path.startswith('/api/') or path.startswith(BATCH_PATH)
+                    or path.startswith(PROFILE_PATH) or path.startswith('/api/ngrok')):
+                return dict(result, status=400, body={"error": "Path not allowed in batch"})
+            if needs_api_key(path) and not check_api_key(self.headers):
+                return dict(result, status=401, body={"error": "Unauthorized"})
+            try:
+                data = self.route_api_get(path)
+            except Exception as e:
+                return dict(result, status=500, body={"error": str(e)})
+            if data is None:
+                return dict(result, status=404, body={"error": "Not found"})
+            return dict(result, status=200, body=data)
+        
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(requests))) as pool:
+            futures = [pool.submit(run_one, req) for req in requests]
+            if not stream:
+                self.send_json_response({"responses": [f.result() for f in futures]})
+                return
+            writer = self.start_chunked(200, 'application/x-ndjson', {'Cache-Control': 'no-cache'})
+            for future in as_completed(futures):
+                writer.write(json.dumps(future.result(), ensure_ascii=False).encode() + b'\n')
+                writer.flush()
+            writer.close()
     
-    def send_json_response(self, data):
+    def send_json_response(self, data, status=200, headers=None):
         result = json.dumps(data, ensure_ascii=False).encode()
-        self.send_response(200)
+        self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', len(result))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(result)
     
@@ -230,6 +2532,7 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 },
                 "ngrokUrl": ngrok_url,
                 "uptime": "N/A",
+                "circuit": GATEWAY_BREAKER.snapshot(),
             }
         except Exception as e:
             return {"status": "error", "error": str(e)}
@@ -257,53 +2560,63 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             return {"error": str(e)}
     
-    def get_board(self):
-        """取得留言板內容"""
-        import os
-        try:
-            board_path = os.path.expanduser('~/.openclaw/workspaces/shared/BOARD.md')
-            if os.path.isfile(board_path):
-                with open(board_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                return {"content": content}
-            else:
-                return {"content": "", "error": "Board file not found"}
-        except Exception as e:
-            return {"content": "", "error": str(e)}
+    def get_board(self, path='/api/board'):
+        """取得留言板內容
+
+        預設回傳完整 markdown (content) 與 version；
+        ?format=entries 回傳解析後的留言列表，?since=<version> 只回傳之後新增或變動的留言
+        """
+        return self.query_markdown_index(BOARD_INDEX, path, "Board file not found")
     
-    def get_backlog(self):
-        """取得 Backlog 看板內容"""
-        import os
+    def get_backlog(self, path='/api/backlog'):
+        """取得 Backlog 看板內容 (參數同 get_board，entries 為帶有 column 的卡片)"""
+        return self.query_markdown_index(BACKLOG_INDEX, path, "Backlog file not found")
+    
+    def query_markdown_index(self, index, path, not_found):
+        import urllib.parse
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
         try:
-            backlog_path = os.path.expanduser('~/.openclaw/workspaces/shared/BACKLOG.md')
-            if os.path.isfile(backlog_path):
-                with open(backlog_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                return {"content": content}
-            else:
-                return {"content": "", "error": "Backlog file not found"}
+            if not index.refresh():
+                return {"content": "", "error": not_found}
+            since = query.get('since', [None])[0]
+            if since is None and query.get('format', [''])[0] != 'entries':
+                return {"content": index.content, "version": str(index.version)}
+            return index.query(since)
         except Exception as e:
             return {"content": "", "error": str(e)}
     
-    def send_board_file(self, filename):
+    def get_board_file(self, filename):
         """取得留言板相關檔案"""
         import os
         try:
             # 防止目錄遍歷攻擊
             filename = os.path.basename(filename)
-            file_path = os.path.expanduser(f'~/.openclaw/workspaces/shared/{filename}')
+            file_path = os.path.join(SHARED_WORKSPACE, filename)
             
             if os.path.isfile(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                self.send_json_response({"content": content})
+                def read():
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        return {"content": f.read()}
+                return get_cached(f'board_file:{file_path}', read, ttl=None, deps=[file_path])
             else:
-                self.send_json_response({"error": "File not found"})
+                return {"error": "File not found"}
         except Exception as e:
-            self.send_json_response({"error": str(e)})
+            return {"error": str(e)}
     
     def get_schedules(self):
-        """取得所有 Agent 的排程資訊"""
+        """取得所有 Agent 的排程資訊 (依各 workspace 檔案的 mtime 快取)"""
+        workspaces_path = os.path.expanduser('~/.openclaw/workspaces')
+        deps = [workspaces_path]
+        try:
+            for workspace_dir in sorted(os.listdir(workspaces_path)):
+                deps.append(os.path.join(workspaces_path, workspace_dir, 'HEARTBEAT.md'))
+                deps.append(os.path.join(workspaces_path, workspace_dir, 'IDENTITY.md'))
+        except OSError:
+            pass
+        return get_cached('schedules', self.load_schedules, ttl=None, deps=deps)
+    
+    def load_schedules(self):
+        """讀取每個 workspace 的 HEARTBEAT.md / IDENTITY.md"""
         import os
         import glob
         try:
@@ -364,8 +2677,45 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             return {"schedules": [], "error": str(e)}
     
+    def get_usage(self, path):
+        """用量統計
+
+        參數：groupBy (agentId,model,source,day 的組合，預設 agentId)、from / to (YYYY-MM-DD)、
+        agentId / model / source (逗號分隔多值)
+        """
+        import urllib.parse
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+        group_by = [g for g in query.get('groupBy', ['agentId'])[0].split(',') if g]
+        invalid = [g for g in group_by if g not in USAGE_DIMENSIONS]
+        if invalid:
+            return {"error": f"Invalid groupBy: {', '.join(invalid)}"}
+        filters = {}
+        for name in ('agentId', 'model', 'source'):
+            values = [v for raw in query.get(name, []) for v in raw.split(',') if v]
+            if values:
+                filters[name] = values
+        try:
+            USAGE.refresh()
+            # 來源取自 session 列表 (已快取)，不在列表中的 transcript 歸為 unknown
+            sources = {x.get('id'): x.get('source', 'unknown')
+                       for x in self.get_sessions('/api/sessions').get('sessions', [])}
+            return USAGE.query(group_by, filters, start=query.get('from', [None])[0],
+                               end=query.get('to', [None])[0], sources=sources)
+        except Exception as e:
+            return {"error": str(e)}
+    
+    def get_cron_detail(self, job_id):
+        """單一 Cron Job 的完整內容 (含完整提示詞)"""
+        import urllib.parse
+        job_id = urllib.parse.unquote(job_id)
+        data = self.get_crons()
+        for job in data.get('jobs', []):
+            if job.get('id') == job_id:
+                return {"job": job}
+        return {"error": data.get('error', 'Job not found')}
+    
     def get_crons(self):
-        """取得 Cron Jobs"""
+        """取得 Cron Jobs (列表預設不含完整 message，可用 include=jobs.message 或 /api/cron/<id> 取得)"""
         import os
 
         try:
@@ -460,17 +2810,41 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 return {"agents": agents}
             except Exception as e:
                 return {"agents": [], "error": str(e)}
-        return get_cached('agents', fetch, ttl=60)
+        return get_cached('agents', fetch, ttl=60, deps=[CONFIG_PATH])
     
-    def get_sessions(self):
-        """取得 OpenClaw Sessions"""
-        # 從 URL 參數獲取 agentId
+    def get_sessions(self, path):
+        """取得 OpenClaw Sessions
+
+        參數：agentId / source / label (可用逗號分隔多個值)、from / to (updatedAt 範圍，ms)、
+        limit + cursor (依 updatedAt 由新到舊分頁)、since=<version> (只回傳該索引版本之後有變動的 session 與 removed)
+        """
         import urllib.parse
-        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
-        agent_filter = query.get('agentId', [None])[0]
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+        
+        def int_param(name):
+            try:
+                return int(query[name][0])
+            except (KeyError, ValueError):
+                return None
+        
+        filters = {}
+        for name in SESSION_FILTERS:
+            values = [v for raw in query.get(name, []) for v in raw.split(',') if v]
+            if values:
+                filters[name] = values
+        limit = int_param('limit')
+        if limit is not None:
+            limit = max(1, min(limit, SESSION_PAGE_MAX))
+        cursor = None
+        if query.get('cursor'):
+            updated_at, _, sid = query['cursor'][0].partition(':')
+            try:
+                cursor = (-int(updated_at), sid)
+            except ValueError:
+                return {"sessions": [], "error": "Invalid cursor"}
         
-        # 使用 agent_filter 作為快取 key 的一部分
-        cache_key = f'sessions_{agent_filter or "all"}'
+        # 所有 agent 共用一份列表，篩選交給索引
+        cache_key = 'sessions_all'
         
         def fetch():
             try:
@@ -493,10 +2867,6 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                         if '.reset.' in key or ':run:' in key:
                             continue
                         
-                        # 如果有篩選條件，跳過不符的
-                        if agent_filter and agent_id != agent_filter:
-                            continue
-                        
                         # 解析 key 取得來源和名稱
                         source = 'unknown'
                         name = ''
@@ -513,7 +2883,6 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                                 session_part = key.split('_session_')[-1] if '_session_' in key else ''
                                 if session_part.isdigit():
                                     # 是時間戳格式，轉換為可讀時間
-                                    import time
                                     try:
                                         ts = int(session_part) / 1000
                                         time_str = time.strftime('%m/%d %H:%M', time.localtime(ts))
@@ -544,14 +2913,7 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                         
                         # 格式化時間
                         age_ms = s.get('ageMs', 0)
-                        if age_ms < 60000:
-                            age = f"{age_ms//1000}秒前"
-                        elif age_ms < 3600000:
-                            age = f"{age_ms//60000}分前"
-                        elif age_ms < 86400000:
-                            age = f"{age_ms//3600000}小時前"
-                        else:
-                            age = f"{age_ms//86400000}天前"
+                        age = format_age(age_ms)
                         
                         sessions.append({
                             "id": s.get('sessionId', ''),
@@ -570,111 +2932,193 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                     
                     # 按更新时间排序
                     sessions.sort(key=lambda x: x.get('updatedAt', 0), reverse=True)
-                    return {"sessions": sessions, "count": len(sessions)}
+                    return {"sessions": sessions, "count": len(sessions), "fetchedAt": int(time.time() * 1000)}
                 else:
                     return {"sessions": [], "error": result.stderr}
             except Exception as e:
                 return {"sessions": [], "error": str(e)}
-        return get_cached(cache_key, fetch, ttl=10)
+        data = get_cached(cache_key, fetch, ttl=10, deps=session_index_paths())
+        if 'error' in data:
+            return data
+        SESSION_INDEX.update(data)
+        result = SESSION_INDEX.query(filters, since=int_param('since'), start=int_param('from'),
+                                     end=int_param('to'), cursor=cursor, limit=limit)
+        # 從持久化快取還原的列表，ageMs 以取得時間為基準重新計算 (只處理回傳的這一頁)
+        fetched_at = data.get('fetchedAt')
+        result["fetchedAt"] = fetched_at
+        elapsed = int(time.time() * 1000) - fetched_at if fetched_at else 0
+        if elapsed > 10000:
+            sessions = []
+            for s in result['sessions']:
+                age_ms = s.get('ageMs', 0) + elapsed
+                sessions.append(dict(s, ageMs=age_ms, age=format_age(age_ms)))
+            result['sessions'] = sessions
+        return result
     
     def get_session_messages(self, session_id):
         """取得 Session 的訊息歷史"""
-        import os
-        
         # 直接從本地文件系統查找 session 文件
-        agent_id = None
-        for agent_check in ['code', 'main', 'rich', 'chef', 'travel', 'startup', 'skill-manager', 'ip', 'nexchip']:
-            session_dir = os.path.expanduser(f"~/.openclaw/agents/{agent_check}/sessions")
-            target_file = os.path.join(session_dir, f"{session_id}.jsonl")
-            if os.path.exists(target_file):
-                agent_id = agent_check
-                break
-        
+        agent_id, filepath = find_session_file(session_id)
         if not agent_id:
             return {"error": "Session not found", "messages": [], "session_id": session_id}
         
-        agent = agent_id
-        
-        # 查找對應的 session 文件
-        session_dir = os.path.expanduser(f"~/.openclaw/agents/{agent}/sessions")
-        
-        # 嘗試找到對應的 jsonl 文件
+        # 解析結果依 transcript 的 mtime 快取，檔案有變動才重新解析
+        return get_cached(f'messages:v3:{filepath}', lambda: self.parse_session_messages(filepath, agent_id),
+                          ttl=None, deps=[filepath])
+    
+    def parse_session_messages(self, filepath, agent_id):
+        """解析 transcript JSONL 為訊息列表
+
+        內容截斷為 2000 字、不含思考與工具細節；hasDetail / truncated 的訊息可用
+        /api/session/<id>/messages/<message_id> 取得完整內容。offsets 記錄每則 message 行
+        (含未列出的純思考訊息) 在檔案中的位置；未列出的訊息 id 放在下一則訊息的 detailIds。
+        """
         messages = []
+        offsets = {}
+        hidden_ids = []  # 尚未歸屬的未列出訊息
         try:
-            files = os.listdir(session_dir)
-            # 直接用 session_id 匹配
-            target_file = f"{session_id}.jsonl"
-            if target_file in files:
-                filepath = os.path.join(session_dir, target_file)
-                # 讀取 JSONL 文件
-                with open(filepath, 'r') as fp:
-                    for line in fp:
-                        try:
-                            entry = json.loads(line)
-                            if entry.get('type') == 'message':
-                                msg = entry.get('message', {})
-                                role = msg.get('role', '')
-                                content = msg.get('content', [])
-                                
-                                # 檢查是否純思考內容（只有 thinking 沒有 text）
-                                is_thinking_only = False
-                                text_content = ''
-                                thinking_content = ''
-                                tool_calls = []
-                                if isinstance(content, list):
-                                    has_text = False
-                                    for c in content:
-                                        if isinstance(c, dict):
-                                            if c.get('type') == 'text' and c.get('text'):
-                                                has_text = True
-                                            elif c.get('type') == 'thinking':
-                                                thinking_content += c.get('thinking', '') + '\n\n'
-                                            elif c.get('type') == 'toolCall':
-                                                tool_calls.append(c.get('name', 'unknown'))
-                                    is_thinking_only = not has_text and bool(thinking_content)
-                                    
-                                    for c in content:
-                                        if isinstance(c, dict):
-                                            if c.get('type') == 'text':
-                                                text_content += c.get('text', '')
-                                elif isinstance(content, str):
-                                    text_content = content[:500]
-                                
-                                # 跳過純思考的訊息（會合併到主要訊息中）
-                                if is_thinking_only:
-                                    continue
-                                
-                                # 清理 HTML 標籤
-                                import re
-                                text_content = re.sub(r'<[^>]+>', '', text_content)
-                                text_content = text_content.strip()
-                                thinking_content = re.sub(r'<[^>]+>', '', thinking_content).strip()
-                                
-                                # 組合內容（歷史訊息不顯示思考過程）
-                                full_content = text_content
-                                if tool_calls:
-                                    full_content += f"\n\n🔧 使用工具：{', '.join(tool_calls)}"
-                                
-                                # 跳過空的或只有思考標題的內容
-                                if not full_content or full_content.startswith('🤔 思考過程：\n\n📝 回答：\n'):
-                                    continue
-                                
-                                # 跳過重複的思考訊息（以思考開頭的獨立訊息）
-                                if full_content.startswith('🤔 思考過程：') and '📝 回答：\n\n' not in full_content:
-                                    continue
+            with open(filepath, 'rb') as fp:
+                offset = 0
+                for lineno, line in enumerate(fp):
+                    line_offset = offset
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                        if entry.get('type') == 'message':
+                            message_id = str(entry.get('id') or f'L{lineno}')
+                            offsets[message_id] = line_offset
+                            msg = entry.get('message', {})
+                            role = msg.get('role', '')
+                            content = msg.get('content', [])
+                            
+                            # 檢查是否純思考內容（只有 thinking 沒有 text）
+                            is_thinking_only = False
+                            text_content = ''
+                            thinking_content = ''
+                            tool_calls = []
+                            if isinstance(content, list):
+                                has_text = False
+                                for c in content:
+                                    if isinstance(c, dict):
+                                        if c.get('type') == 'text' and c.get('text'):
+                                            has_text = True
+                                        elif c.get('type') == 'thinking':
+                                            thinking_content += c.get('thinking', '') + '\n\n'
+                                        elif c.get('type') == 'toolCall':
+                                            tool_calls.append(c.get('name', 'unknown'))
+                                # 帶有工具呼叫的訊息照常列出 (顯示使用的工具)
+                                is_thinking_only = not has_text and not tool_calls and bool(thinking_content)
                                 
-                                if full_content:
-                                    messages.append({
-                                        "role": role,
-                                        "content": full_content[:2000],
-                                        "timestamp": entry.get('timestamp', '')
-                                    })
-                        except:
-                            continue
+                                for c in content:
+                                    if isinstance(c, dict):
+                                        if c.get('type') == 'text':
+                                            text_content += c.get('text', '')
+                            elif isinstance(content, str):
+                                text_content = content[:500]
+                            
+                            # 跳過純思考的訊息（會合併到主要訊息中）
+                            if is_thinking_only:
+                                hidden_ids.append(message_id)
+                                continue
+                            
+                            # 清理 HTML 標籤
+                            import re
+                            text_content = re.sub(r'<[^>]+>', '', text_content)
+                            text_content = text_content.strip()
+                            thinking_content = re.sub(r'<[^>]+>', '', thinking_content).strip()
+                            
+                            # 組合內容（歷史訊息不顯示思考過程）
+                            full_content = text_content
+                            if tool_calls:
+                                full_content = (full_content + f"\n\n🔧 使用工具：{', '.join(tool_calls)}").strip()
+                            
+                            # 跳過空的或只有思考標題的內容
+                            if not full_content or full_content.startswith('🤔 思考過程：\n\n📝 回答：\n'):
+                                hidden_ids.append(message_id)
+                                continue
+                            
+                            # 跳過重複的思考訊息（以思考開頭的獨立訊息）
+                            if full_content.startswith('🤔 思考過程：') and '📝 回答：\n\n' not in full_content:
+                                hidden_ids.append(message_id)
+                                continue
+                            
+                            if full_content:
+                                item = {
+                                    "id": message_id,
+                                    "role": role,
+                                    "content": full_content[:2000],
+                                    "timestamp": entry.get('timestamp', ''),
+                                    "hasDetail": bool(thinking_content or tool_calls or hidden_ids),
+                                    "truncated": len(full_content) > 2000,
+                                }
+                                if hidden_ids:
+                                    item["detailIds"] = hidden_ids
+                                    hidden_ids = []
+                                messages.append(item)
+                    except:
+                        continue
         except Exception as e:
             return {"error": str(e), "messages": []}
         
-        return {"messages": messages, "agentId": agent_id}
+        return {"messages": messages, "agentId": agent_id, "offsets": offsets}
+    
+    def get_session_message_detail(self, session_id, message_id):
+        """單則訊息的完整內容：不截斷的文字、思考過程、工具呼叫參數與對應的工具結果"""
+        agent_id, filepath = find_session_file(session_id)
+        if not agent_id:
+            return {"error": "Session not found"}
+        offset = self.get_session_messages(session_id).get('offsets', {}).get(message_id)
+        if offset is None:
+            return {"error": "Message not found"}
+        try:
+            with open(filepath, 'rb') as fp:
+                fp.seek(offset)
+                entry = json.loads(fp.readline())
+                msg = entry.get('message', {})
+                content = msg.get('content', [])
+                if isinstance(content, str):
+                    content = [{"type": "text", "text": content}]
+                detail = {
+                    "id": message_id,
+                    "role": msg.get('role', ''),
+                    "timestamp": entry.get('timestamp', ''),
+                    "model": msg.get('model', ''),
+                    "usage": msg.get('usage'),
+                    "content": ''.join(c.get('text', '') for c in content if isinstance(c, dict) and c.get('type') == 'text'),
+                    "thinking": '\n\n'.join(c.get('thinking', '') for c in content
+                                             if isinstance(c, dict) and c.get('type') == 'thinking'),
+                    "toolCalls": [{"id": c.get('id'), "name": c.get('name'), "arguments": c.get('arguments')}
+                                  for c in content if isinstance(c, dict) and c.get('type') == 'toolCall'],
+                    "toolResults": [],
+                }
+                # 工具結果緊接在呼叫之後，讀到下一則 user / assistant 訊息為止
+                pending = {c['id'] for c in detail['toolCalls'] if c.get('id')}
+                while pending:
+                    line = fp.readline()
+                    if not line:
+                        break
+                    try:
+                        nxt = json.loads(line)
+                    except ValueError:
+                        continue
+                    if nxt.get('type') != 'message':
+                        continue
+                    result = nxt.get('message', {})
+                    if result.get('role') != 'toolResult':
+                        break
+                    pending.discard(result.get('toolCallId'))
+                    result_content = result.get('content', [])
+                    detail['toolResults'].append({
+                        "toolCallId": result.get('toolCallId'),
+                        "toolName": result.get('toolName'),
+                        "isError": result.get('isError', False),
+                        "content": result_content if isinstance(result_content, str) else
+                                   ''.join(c.get('text', '') for c in result_content
+                                           if isinstance(c, dict) and c.get('type') == 'text'),
+                    })
+            return {"message": detail, "sessionId": session_id, "agentId": agent_id}
+        except Exception as e:
+            return {"error": str(e)}
     
     def get_channels(self):
         """取得 Channels 狀態"""
@@ -702,7 +3146,7 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 return {"channels": result}
             except Exception as e:
                 return {"channels": {}, "error": str(e)}
-        return get_cached('channels', fetch, ttl=60)
+        return get_cached('channels', fetch, ttl=60, deps=[CONFIG_PATH])
     
     def get_config(self):
         """取得完整配置"""
@@ -722,7 +3166,7 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 return {"config": config}
             except Exception as e:
                 return {"error": str(e)}
-        return get_cached('config', fetch, ttl=60)
+        return get_cached('config', fetch, ttl=60, deps=[CONFIG_PATH])
     
     def get_agent_detail(self, agent_id):
         """取得單一 Agent 詳情"""
@@ -907,141 +3351,741 @@ class CORSHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             return {"error": str(e)}
     
-    def do_POST(self):
+    def handle_profile_request(self):
+        """效能分析管理端點 (需設置 API_KEY)
+
+        POST /api/admin/profile/start?mode=cprofile|sample&requests=N&seconds=T&prefix=/api/sessions
+             (參數也可放在 JSON body：{"mode": "cprofile", "requests": 50}，與 query 同時出現時以 body 為準)
+        POST /api/admin/profile/stop
+        GET  /api/admin/profile?limit=30            熱點函式匯總
+        GET  /api/admin/profile?format=pstats       下載 .pstats (cprofile 模式)
+        """
+        import urllib.parse
+        if not API_KEY:
+            self.send_error(403, 'API_KEY not configured')
+            return
+        if not check_api_key(self.headers):
+            self.send_error(401, 'Unauthorized')
+            return
+        parsed = urllib.parse.urlparse(self.path)
+        options = {name: values[0] for name, values in urllib.parse.parse_qs(parsed.query).items()}
+        action = parsed.path[len(PROFILE_PATH):].strip('/')
+        body = self.read_body()
+        if body.strip():
+            try:
+                body = json.loads(body)
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                self.send_json_response({"error": "Invalid JSON"}, status=400)
+                return
+            options.update(body)
+        
+        def param(name, default, cast=str):
+            try:
+                return cast(options.get(name, default))
+            except (TypeError, ValueError):
+                return default
+        
+        multiprocess = IN_WORKER and _shared_cache is not None
+        if self.command == 'POST':
+            if action == 'start':
+                params = dict(
+                    mode=param('mode', PROFILE_DEFAULT_MODE),
+                    requests=param('requests', 0, int),
+                    seconds=param('seconds', 0, float),
+                    prefix=param('prefix', ''),
+                    interval=param('interval', PROFILE_SAMPLE_INTERVAL * 1000, float) / 1000,
+                )
+                if params['mode'] not in ('cprofile', 'sample'):
+                    self.send_json_response({"error": f"Unknown mode: {params['mode']}"}, status=400)
+                    return
+                # 多行程模式：通知所有 worker 一起開始
+                self.send_json_response(PROFILER.control('start', **params) if multiprocess
+                                        else PROFILER.start(**params))
+            elif action == 'stop':
+                self.send_json_response(PROFILER.control('stop') if multiprocess else PROFILER.stop())
+            else:
+                self.send_error(404)
+            return
+        
+        if action or self.command != 'GET':
+            self.send_error(404)
+            return
+        snapshot = PROFILER.collect() if multiprocess else None
+        if param('format', 'json') == 'pstats':
+            data = PROFILER.dump_pstats(snapshot)
+            if data is None:
+                self.send_json_response({"error": "No cProfile data"}, status=404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="clawchat-{int(time.time())}.pstats"')
+            self.send_header('Content-Length', len(data))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_json_response(PROFILER.summary(limit=param('limit', 30, int), snapshot=snapshot))
+    
+    def proxy_to_gateway(self, url):
+        """轉發請求到 Gateway (支援 SSE)，body 中的附件引用會在轉發時展開"""
+        body = self.read_body()
+        
+        # 檢查是否需要流式輸出
+        try:
+            body_json = json.loads(body)
+            stream = body_json.get('stream', False)
+        except:
+            stream = False
+        
+        # 將 "attachment:<sha256>" 展開為 data URL，邊讀檔邊送出
+        try:
+            gateway_resp = open_gateway(url, body)
+        except GatewayUnavailable as e:
+            self.send_json_response({"error": str(e), "retryAfter": e.retry_after}, status=503,
+                                    headers={'Retry-After': str(e.retry_after)})
+            return
+        except AttachmentNotFound as e:
+            self.send_json_response({"error": str(e), "missing": e.missing}, status=400)
+            return
+        except urllib.error.HTTPError as e:
+            error_body = e.read()
+            self.send_response(e.code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', len(error_body))
+            self.end_headers()
+            self.wfile.write(error_body)
+            return
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, status=504 if isinstance(e, TimeoutError) else 502)
+            return
+        
+        with gateway_resp:
+            if stream:
+                # SSE 流式轉發 (chunked，連線可重用)
+                writer = self.start_chunked(200, 'text/event-stream', {
+                    'Cache-Control': 'no-cache',
+                    'Access-Control-Allow-Headers': 'Content-Type',
+                })
+                try:
+                    for chunk in gateway_chunks(gateway_resp):
+                        writer.write(chunk)
+                        writer.flush()
+                    writer.close()
+                except Exception:
+                    # 標頭已送出，只能中斷連線讓客戶端察覺回應不完整
+                    self.close_connection = True
+            else:
+                # 普通模式（完整響應）
+                try:
+                    result = b''.join(gateway_chunks(gateway_resp, 65536))
+                except Exception as e:
+                    self.send_json_response({"error": str(e)}, status=504 if isinstance(e, TimeoutError) else 502)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', len(result))
+                self.end_headers()
+                self.wfile.write(result)
+    
+    def handle_websocket(self):
+        """WebSocket：GET /api/ws (Upgrade)，一條連線承載多個聊天串流
+
+        客戶端 → 伺服器 (JSON text frame)：
+          {"type": "chat", "id": "<請求 id>", "sessionId": "...", "path": "/v1/chat/completions", "body": {...}}
+          {"type": "cancel", "id": "..."}
+          {"type": "join" | "leave", "sessionId": "..."}    presence
+        伺服器 → 客戶端：
+          chunk (SSE 的 data 內容) / done / cancelled / error，皆帶 id 與 sessionId；
+          presence {"sessionId", "clients", "streaming"}；session {"sessionId", "event": "updated"}
+        """
+        import urllib.parse
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        if self.headers.get('Upgrade', '').lower() != 'websocket' or not key:
+            self.send_json_response({"error": "WebSocket upgrade required"}, status=426)
+            return
+        # 瀏覽器的 WebSocket 不受 CORS 限制，需自行檢查 Origin (同源或在允許列表中)
+        origin = self.headers.get('Origin', '')
+        if origin and urllib.parse.urlparse(origin).netloc != self.headers.get('Host', '') \
+                and not get_allowed_origin(origin):
+            self.send_json_response({"error": "Origin not allowed"}, status=403)
+            return
+        
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.close_connection = True
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.connection.settimeout(None)
+        
+        ws = WebSocketConnection(self.connection, self.rfile, self.wfile)
+        WS_HUB.add(ws)
+        done = threading.Event()
+        
+        def keepalive():
+            while not done.wait(WS_PING_INTERVAL):
+                if time.time() - ws.last_seen > WS_PING_INTERVAL * 2:
+                    ws.abort()
+                    return
+                try:
+                    ws.send_frame(0x9, b'')
+                except WebSocketClosed:
+                    return
+        
+        threading.Thread(target=keepalive, daemon=True).start()
+        try:
+            ws.send_json({"type": "hello", "maxStreams": WS_MAX_STREAMS})
+            while True:
+                opcode, payload = ws.recv()
+                try:
+                    msg = json.loads(payload) if opcode == 0x1 else None
+                except ValueError:
+                    msg = None
+                if not isinstance(msg, dict):
+                    ws.send_json({"type": "error", "error": "Expected a JSON object text frame"})
+                    continue
+                self.handle_ws_message(ws, msg)
+        except (WebSocketClosed, OSError):
+            pass
+        finally:
+            done.set()
+            ws.closed = True
+            for _, cancel in list(ws.streams.values()):
+                cancel.set()
+            WS_HUB.remove(ws)
+    
+    def handle_ws_message(self, ws, msg):
+        kind = msg.get('type')
+        req_id = msg.get('id')
+        session_id = msg.get('sessionId') or None
+        if kind == 'chat':
+            path = msg.get('path') or WS_CHAT_PATHS[0]
+            if not isinstance(req_id, str) or not req_id or req_id in ws.streams:
+                ws.send_json({"type": "error", "id": req_id, "sessionId": session_id, "error": "Missing or duplicate id"})
+            elif path not in WS_CHAT_PATHS or not isinstance(msg.get('body'), dict):
+                ws.send_json({"type": "error", "id": req_id, "sessionId": session_id, "error": "Invalid chat request"})
+            elif len(ws.streams) >= WS_MAX_STREAMS:
+                ws.send_json({"type": "error", "id": req_id, "sessionId": session_id, "status": 429,
+                              "error": f"Too many concurrent streams (max {WS_MAX_STREAMS})"})
+            else:
+                cancel = threading.Event()
+                ws.streams[req_id] = (session_id, cancel)
+                body = json.dumps(msg['body']).encode()
+                threading.Thread(target=self.ws_chat_stream, daemon=True,
+                                 args=(ws, req_id, session_id, f"{GATEWAY_URL}{path}", body, cancel)).start()
+                if session_id:
+                    WS_HUB.presence(session_id)
+        elif kind == 'cancel':
+            stream = ws.streams.get(req_id)
+            if stream:
+                # 串流執行緒在下一個 chunk 時停止並關閉 Gateway 連線
+                stream[1].set()
+                ws.send_json({"type": "cancelled", "id": req_id, "sessionId": stream[0]})
+        elif kind in ('join', 'leave') and session_id:
+            if kind == 'join':
+                ws.sessions.add(session_id)
+            else:
+                ws.sessions.discard(session_id)
+            WS_HUB.presence(session_id)
+        else:
+            ws.send_json({"type": "error", "id": req_id, "error": f"Unknown message type: {kind}"})
+    
+    def ws_chat_stream(self, ws, req_id, session_id, url, body, cancel):
+        """在獨立執行緒轉發一個聊天請求，SSE 的每個 data 行轉為一則 chunk 訊息"""
+        tag = {"id": req_id, "sessionId": session_id}
+        completed = False
+        try:
+            try:
+                gateway_resp = open_gateway(url, body)
+            except GatewayUnavailable as e:
+                ws.send_json(dict(tag, type="error", status=503, error=str(e), retryAfter=e.retry_after))
+                return
+            except AttachmentNotFound as e:
+                ws.send_json(dict(tag, type="error", status=400, error=str(e), missing=e.missing))
+                return
+            except urllib.error.HTTPError as e:
+                ws.send_json(dict(tag, type="error", status=e.code, error=e.read().decode('utf-8', 'replace')))
+                return
+            except Exception as e:
+                ws.send_json(dict(tag, type="error", status=500, error=str(e)))
+                return
+            with gateway_resp:
+                if not json.loads(body).get('stream'):
+                    result = b''.join(gateway_chunks(gateway_resp, 65536))
+                    try:
+                        result = json.loads(result)
+                    except ValueError:
+                        result = result.decode('utf-8', 'replace')
+                    ws.send_json(dict(tag, type="done", response=result))
+                    completed = True
+                    return
+                buffer = b''
+                for chunk in gateway_chunks(gateway_resp):
+                    if cancel.is_set():
+                        break
+                    lines = (buffer + chunk).split(b'\n')
+                    buffer = lines.pop()
+                    for line in lines:
+                        line = line.rstrip(b'\r')
+                        if not line.startswith(b'data:'):
+                            continue
+                        data = line[5:].decode('utf-8', 'replace')
+                        data = data[1:] if data.startswith(' ') else data
+                        if data != '[DONE]' and not cancel.is_set():
+                            ws.send_json(dict(tag, type="chunk", data=data))
+                if not cancel.is_set():
+                    ws.send_json(dict(tag, type="done"))
+                    completed = True
+        except WebSocketClosed:
+            pass
+        except Exception as e:
+            try:
+                ws.send_json(dict(tag, type="error", status=502, error=str(e)))
+            except WebSocketClosed:
+                pass
+        finally:
+            ws.streams.pop(req_id, None)
+            if session_id:
+                WS_HUB.presence(session_id)
+                if completed:
+                    WS_HUB.publish({"type": "session", "sessionId": session_id, "event": "updated"})
+    
+    def handle_session_export(self):
+        """匯出完整 (不截斷) 的對話記錄，以 chunked 串流輸出，記憶體用量與 transcript 大小無關
+
+        GET /api/session/<id>/export?format=ndjson|md|zip
+        GET /api/sessions/export?ids=a,b,c&format=zip&entry=ndjson|md   (或 agentId=<agent> 匯出該 agent 全部)
+        ndjson 為 transcript 原始行；zip 內每個 session 一個檔案 (<agent>/<id>.jsonl 或 .md)
+        """
+        import urllib.parse
+        import zipfile
+        parsed = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(parsed.query)
+        if parsed.path == '/api/sessions/export':
+            fmt = query.get('format', ['zip'])[0]
+            ids = [v for raw in query.get('ids', []) for v in raw.split(',') if v]
+            agent_id = query.get('agentId', [None])[0]
+            if agent_id and not ids and SESSION_ID_RE.fullmatch(agent_id):
+                sessions_dir = os.path.expanduser(f'~/.openclaw/agents/{agent_id}/sessions')
+                try:
+                    ids = sorted(n[:-len('.jsonl')] for n in os.listdir(sessions_dir) if n.endswith('.jsonl'))
+                except OSError:
+                    ids = []
+        else:
+            fmt = query.get('format', ['ndjson'])[0]
+            ids = [urllib.parse.unquote(parsed.path.split('/')[3])]
+        entry_fmt = query.get('entry', ['ndjson'])[0]
+        
+        if fmt not in EXPORT_FORMATS or entry_fmt not in ('ndjson', 'md'):
+            self.send_json_response({"error": f"Invalid format (use {', '.join(EXPORT_FORMATS)})"}, status=400)
+            return
+        if not ids:
+            self.send_json_response({"error": "No sessions to export"}, status=400)
+            return
+        if len(ids) > EXPORT_MAX_SESSIONS:
+            self.send_json_response({"error": f"Too many sessions (max {EXPORT_MAX_SESSIONS})"}, status=400)
+            return
+        if len(ids) > 1 and fmt != 'zip':
+            self.send_json_response({"error": "Multiple sessions require format=zip"}, status=400)
+            return
+        sessions = []
+        missing = []
+        for session_id in ids:
+            agent_id, path = find_session_file(session_id)
+            if path:
+                sessions.append((session_id, agent_id, path))
+            else:
+                missing.append(session_id)
+        if missing:
+            self.send_json_response({"error": "Session not found", "missing": missing}, status=404)
+            return
+        
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        if fmt == 'zip':
+            name = f'{ids[0]}.zip' if len(ids) == 1 else f'clawchat-sessions-{stamp}.zip'
+            content_type = 'application/zip'
+        elif fmt == 'md':
+            name, content_type = f'{ids[0]}.md', 'text/markdown; charset=utf-8'
+        else:
+            name, content_type = f'{ids[0]}.jsonl', 'application/x-ndjson'
+        writer = self.start_chunked(200, content_type, {
+            'Content-Disposition': f'attachment; filename="{name}"',
+            'Cache-Control': 'no-store',
+        }, buffer_size=EXPORT_BUFFER_SIZE)
+        
+        try:
+            if fmt == 'zip':
+                # writer 無法 seek，zipfile 會改用 data descriptor 記錄大小與 CRC
+                with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                    for session_id, agent_id, path in sessions:
+                        size = os.path.getsize(path)
+                        info = zipfile.ZipInfo(f'{agent_id}/{session_id}.{"md" if entry_fmt == "md" else "jsonl"}',
+                                               time.localtime(os.path.getmtime(path))[:6])
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        # 大小未知時需預先決定是否使用 zip64 (Markdown 可能比原檔大)
+                        with zf.open(info, 'w', force_zip64=size * 2 > zipfile.ZIP64_LIMIT) as out:
+                            lines = iter_transcript_lines(path)
+                            if entry_fmt == 'md':
+                                for text in transcript_markdown(session_id, agent_id, lines):
+                                    out.write(text.encode())
+                            else:
+                                for line in lines:
+                                    out.write(line)
+            else:
+                session_id, agent_id, path = sessions[0]
+                lines = iter_transcript_lines(path)
+                if fmt == 'md':
+                    for text in transcript_markdown(session_id, agent_id, lines):
+                        writer.write(text.encode())
+                else:
+                    for line in lines:
+                        writer.write(line)
+            writer.close()
+        except Exception as e:
+            # 標頭已送出，中斷連線讓客戶端察覺下載不完整
+            print(f"Export failed: {e}")
+            self.close_connection = True
+    
+    def handle_attachment_upload(self):
+        """上傳附件：POST /api/attachments，body 為原始檔案內容，Content-Type 為 MIME 類型
+
+        只接受 image/* (其他類型回 415)。以串流方式寫入內容定址的儲存區 (相同內容只存一份)，
+        回傳可放在訊息中的引用：
+        {"ref": "attachment:<sha256>", "id": "<sha256>", "size": ..., "mime": ...}
+        """
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_json_response({"error": "Content-Length required"}, status=411)
+            return
+        length = int(length)
+        if length <= 0:
+            self.send_json_response({"error": "Empty attachment"}, status=400)
+            return
+        if length > ATTACHMENT_MAX_BYTES:
+            self.send_json_response({"error": f"Attachment too large (max {ATTACHMENT_MAX_BYTES} bytes)"}, status=413)
+            self.close_connection = True
+            return
+        mime = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if not ATTACHMENT_MIME_RE.match(mime):
+            self.send_json_response({"error": "Unsupported attachment type (image/* only)"}, status=415)
+            self.close_connection = True
+            return
+        try:
+            result = store_attachment(self.rfile, length, mime)
+            self._body_unread = 0
+        except Exception as e:
+            # 不確定已讀到 body 的哪裡，回應後關閉連線
+            self.close_connection = True
+            self.send_json_response({"error": str(e)}, status=500)
+            return
+        self.send_json_response(result)
+    
+    def handle_attachment_get(self, head=False):
+        """GET/HEAD /api/attachments/<sha256>：取得附件內容或檢查是否已存在"""
+        digest = self.path.split('?', 1)[0][len(ATTACHMENTS_PATH) + 1:]
+        meta = load_attachment_meta(digest)
+        if meta is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        path = attachment_path(digest)
+        touch_attachment(digest)
+        self.send_response(200)
+        self.send_header('Content-Type', meta.get('mime', 'application/octet-stream'))
+        self.send_header('Content-Length', str(meta.get('size', 0)))
+        self.send_header('Cache-Control', 'private, max-age=31536000, immutable')
+        self.end_headers()
+        if head:
+            return
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+    
+    def _do_POST(self):
         # 每次請求更新 Origin
         self._request_origin = self.headers.get('Origin', '')
         
         # Debug: 打印路徑
         print(f"DEBUG POST path: {self.path}")
         
+        if self.path.startswith(PROFILE_PATH):
+            self.handle_profile_request()
+            return
+        
+        if self.path.startswith(BATCH_PATH):
+            self.handle_batch_request()
+            return
+        
+        if self.path == ATTACHMENTS_PATH:
+            self.handle_attachment_upload()
+            return
+        
         # 支援 /v1/responses API (OpenClaw Web UI 使用的端點)
         if self.path.startswith('/v1/responses'):
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
-            
-            # 檢查是否需要流式輸出
-            try:
-                body_json = json.loads(body)
-                stream = body_json.get('stream', False)
-            except:
-                stream = False
-            
-            req = urllib.request.Request(
-                f"{GATEWAY_URL}{self.path}",
-                data=body,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {GATEWAY_TOKEN}',
-                    'Origin': '*'
-                },
-                method='POST'
-            )
-            
-            try:
-                if stream:
-                    # SSE 流式轉發
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'text/event-stream')
-                    self.send_header('Cache-Control', 'no-cache')
-                    self.send_header('Connection', 'close')
-                    self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                    self.end_headers()
-                    
-                    gateway_resp = urllib.request.urlopen(req, timeout=120)
-                    while True:
-                        chunk = gateway_resp.read(16384)
-                        if not chunk:
-                            break
-                        self.wfile.write(chunk)
-                        self.wfile.flush()
-                    gateway_resp.close()
-                else:
-                    with urllib.request.urlopen(req, timeout=120) as response:
-                        result = response.read()
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(result)
-            except urllib.error.HTTPError as e:
-                error_body = e.read()
-                self.send_response(e.code)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(error_body)
-            except Exception as e:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'error': str(e)}).encode())
+            self.proxy_to_gateway(f"{GATEWAY_URL}{self.path}")
             return
         
         if self.path == '/api/chat':
             # Proxy to Gateway with SSE support
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
-            
-            # 檢查是否需要流式輸出
-            try:
-                body_json = json.loads(body)
-                stream = body_json.get('stream', False)
-            except:
-                stream = False
-            
-            req = urllib.request.Request(
-                f"{GATEWAY_URL}/v1/chat/completions",
-                data=body,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {GATEWAY_TOKEN}',
-                    'Origin': '*'
-                },
-                method='POST'
-            )
-            
-            try:
-                if stream:
-                    # SSE 流式轉發
-                    self.send_response(200)
-                    self.send_header('Content-Type', 'text/event-stream')
-                    self.send_header('Cache-Control', 'no-cache')
-                    self.send_header('Connection', 'close')
-                    self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                    self.end_headers()
-                    
-                    # 優化 chunk size 提升流式響應速度
-                    gateway_resp = urllib.request.urlopen(req, timeout=120)
-                    while True:
-                        chunk = gateway_resp.read(16384)  # 16KB chunks for faster streaming
-                        if not chunk:
-                            break
-                        self.wfile.write(chunk)
-                        self.wfile.flush()
-                    gateway_resp.close()
-                else:
-                    # 普通模式（完整響應）
-                    with urllib.request.urlopen(req, timeout=120) as response:
-                        result = response.read()
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.end_headers()
-                        self.wfile.write(result)
-            except urllib.error.HTTPError as e:
-                error_body = e.read()
-                self.send_response(e.code)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(error_body)
-            except Exception as e:
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.proxy_to_gateway(f"{GATEWAY_URL}/v1/chat/completions")
         else:
             self.send_error(404)
 
-print(f"🚀 ClawChat Server: http://localhost:{PORT}")
-print(f"📡 API: /api/status, /api/agents, /api/channels, /api/config")
+class ClawChatServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """每個連線一個執行緒；多行程模式下各 worker 共用同一個 listening socket"""
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 128
+
+# ========== 設定重新載入 (SIGHUP) 與優雅重啟 (SIGUSR2) ==========
+DRAIN_TIMEOUT = env_setting('DRAIN_TIMEOUT')  # 停止前等待進行中串流完成的上限 (秒)
+HANDOFF_READY_TIMEOUT = 30  # 等待新行程就緒的上限 (秒)，逾時則取消交接並繼續服務
+HANDED_OFF = threading.Event()  # listening socket 已交給新行程
+_handoff_lock = threading.Lock()
+
+# 需要重啟 (SIGUSR2) 才會生效的設定 (可即時重新載入的見檔案開頭的 RELOADABLE_SETTINGS)
+RESTART_SETTINGS = ['PORT', 'WORKERS', 'OPENCLAW_CONFIG_PATH', 'CACHE_DB', 'SHARED_CACHE_PATH', 'ATTACHMENT_DIR']
+
+def reload_config():
+    """SIGHUP：重新讀取 .env，套用可即時生效的設定並清除記憶體快取"""
+    global _cache, GATEWAY_TOKEN
+    changed = load_env()
+    applied = []
+    for name in RELOADABLE_SETTINGS:
+        try:
+            value = env_setting(name)
+        except ValueError as e:
+            print(f"⚠️ Invalid {name}: {e}")
+            continue
+        if globals()[name] != value:
+            globals()[name] = value
+            applied.append(name)
+    token = os.environ.get('GATEWAY_TOKEN', get_gateway_token())
+    if token != GATEWAY_TOKEN:
+        GATEWAY_TOKEN = token
+        applied.append('GATEWAY_TOKEN')
+    CORSHTTPRequestHandler.timeout = KEEPALIVE_TIMEOUT
+    _cache = {}
+    print(f"🔄 {os.getpid()}: config reloaded ({', '.join(applied) or 'no changes'})")
+    restart = [name for name in RESTART_SETTINGS if name in changed]
+    if restart:
+        print(f"⚠️ {', '.join(restart)} changed, send SIGUSR2 to restart")
+
+def create_server():
+    """建立 HTTP server；由舊行程交接時沿用繼承的 listening socket (PORT 已變更則改綁新端口)"""
+    fd = os.environ.pop('CLAWCHAT_HANDOFF_FD', '')
+    if fd:
+        sock = socket.socket(fileno=int(fd))
+        address = sock.getsockname()
+        if address[1] == PORT:
+            httpd = ClawChatServer(address[:2], CORSHTTPRequestHandler, bind_and_activate=False)
+            httpd.socket.close()
+            httpd.socket = sock
+            httpd.server_address = address
+            return httpd
+        sock.close()
+    return ClawChatServer(("", PORT), CORSHTTPRequestHandler)
+
+def notify_ready():
+    """通知交接的舊行程：新行程已開始接受連線"""
+    fd = os.environ.pop('CLAWCHAT_HANDOFF_READY_FD', '')
+    if fd:
+        try:
+            os.write(int(fd), b'1')
+            os.close(int(fd))
+        except OSError:
+            pass
+
+def spawn_successor(httpd, extra_env=None):
+    """以同一個 listening socket 啟動新的 server.py，等待其就緒；成功回傳 True"""
+    import select
+    import subprocess
+    listen_fd = httpd.socket.fileno()
+    ready_r, ready_w = os.pipe()
+    env = dict(BASE_ENV, CLAWCHAT_HANDOFF_FD=str(listen_fd), CLAWCHAT_HANDOFF_READY_FD=str(ready_w), **(extra_env or {}))
+    try:
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__)] + sys.argv[1:],
+                                env=env, pass_fds=(listen_fd, ready_w))
+    except OSError as e:
+        print(f"❌ Restart failed: {e}")
+        os.close(ready_r)
+        return False
+    finally:
+        os.close(ready_w)
+    ready = False
+    deadline = time.time() + HANDOFF_READY_TIMEOUT
+    try:
+        while proc.poll() is None and time.time() < deadline:
+            if select.select([ready_r], [], [], 0.5)[0]:
+                ready = os.read(ready_r, 1) == b'1'
+                break
+    finally:
+        os.close(ready_r)
+    if not ready:
+        print(f"❌ New server {proc.pid} did not become ready, keep serving")
+        if proc.poll() is None:
+            proc.kill()
+        return False
+    print(f"🔁 {os.getpid()}: handed off to {proc.pid}")
+    return True
+
+def start_handoff(httpd, extra_env=None):
+    """SIGUSR2：背景啟動新行程，就緒後對自己送出 SIGQUIT 進入排空；失敗時繼續服務"""
+    if not _handoff_lock.acquire(blocking=False):
+        return
+    
+    def run():
+        if spawn_successor(httpd, extra_env):
+            HANDED_OFF.set()
+            os.kill(os.getpid(), signal.SIGQUIT)
+        else:
+            _handoff_lock.release()
+    
+    threading.Thread(target=run, daemon=True).start()
+
+def request_stop(httpd):
+    """停止接受新連線 (shutdown 會等待 serve_forever 結束，需在其他執行緒呼叫)"""
+    threading.Thread(target=httpd.shutdown, daemon=True).start()
 
-socketserver.TCPServer.allow_reuse_address = True
-with socketserver.TCPServer(("", PORT), CORSHTTPRequestHandler) as httpd:
+def serve_and_drain(httpd):
+    """serve_forever 直到 request_stop，之後關閉 listening socket 並等待進行中的請求 (最多 DRAIN_TIMEOUT 秒)"""
     httpd.serve_forever()
+    httpd.server_close()
+    print(f"⏳ {os.getpid()}: draining {CONNECTIONS.active} active requests (up to {DRAIN_TIMEOUT}s)")
+    if CONNECTIONS.drain(time.time() + DRAIN_TIMEOUT):
+        print(f"👋 {os.getpid()}: drained")
+    else:
+        print(f"⚠️ {os.getpid()}: drain timeout, dropping {CONNECTIONS.active} requests")
+
+def run_worker(httpd):
+    """worker 行程：在繼承的 listening socket 上處理請求；SIGQUIT 時排空後結束"""
+    global IN_WORKER
+    IN_WORKER = True
+    signal.signal(signal.SIGUSR1, lambda signum, frame: PROFILER.apply_control())
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_config())
+    signal.signal(signal.SIGQUIT, lambda signum, frame: request_stop(httpd))
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    try:
+        serve_and_drain(httpd)
+    finally:
+        os._exit(0)
+
+def run_supervisor(httpd, count, handoff_env=None):
+    """pre-fork 監督者：啟動 count 個 worker，異常退出時自動重啟
+
+    SIGHUP 轉發給 worker 重新載入設定；SIGUSR1 轉發給 worker 套用效能分析的控制紀錄；
+    SIGQUIT 讓 worker 排空後結束；
+    SIGUSR2 啟動新的監督者接手 listening socket，就緒後舊 worker 排空結束。
+    """
+    workers = {}
+    restarts = []
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(httpd)
+        workers[pid] = time.time()
+        if stopping:
+            os.kill(pid, signal.SIGQUIT)
+        return pid
+
+    def signal_workers(signum):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        signal_workers(signal.SIGTERM)
+
+    def graceful(signum, frame):
+        nonlocal stopping
+        stopping = True
+        signal_workers(signal.SIGQUIT)
+
+    def reload(signum, frame):
+        reload_config()
+        signal_workers(signal.SIGHUP)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGQUIT, graceful)
+    signal.signal(signal.SIGHUP, reload)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: signal_workers(signal.SIGUSR1))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: start_handoff(httpd, handoff_env))
+
+    for _ in range(count):
+        spawn()
+    print(f"👷 Supervisor {os.getpid()}: {count} workers {sorted(workers)}")
+    notify_ready()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        # 交接時啟動的新行程也是子行程，不在 workers 中，不需重啟
+        if workers.pop(pid, None) is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+        print(f"⚠️ Worker {pid} exited ({code}), restarting")
+        # 短時間內反覆崩潰時放慢重啟速度
+        now = time.time()
+        restarts = [t for t in restarts if now - t < 10] + [now]
+        if len(restarts) > count * 2:
+            time.sleep(1)
+        spawn()
+    httpd.server_close()
+
+def main():
+    httpd = create_server()
+    print(f"🚀 ClawChat Server: http://localhost:{PORT}")
+    print(f"📡 API: /api/status, /api/agents, /api/channels, /api/config")
+
+    STATIC_ASSETS.preload(SCRIPT_DIR, STATIC_PRELOAD)
+    multiprocess = WORKERS > 1 and hasattr(os, 'fork')
+    cache_path = CACHE_DB or SHARED_CACHE_PATH
+    # 由舊行程交接來的暫存快取檔，由本行程負責清除
+    owns_cache = os.environ.pop('CLAWCHAT_HANDOFF_CACHE', '') == '1'
+    if multiprocess and not cache_path:
+        import tempfile
+        cache_path = os.path.join(tempfile.gettempdir(), f'clawchat-cache-{os.getpid()}.sqlite')
+        owns_cache = True
+    if cache_path:
+        init_shared_cache(cache_path)
+    # 交接時讓新行程沿用同一個快取檔
+    handoff_env = {'SHARED_CACHE_PATH': cache_path, 'CLAWCHAT_HANDOFF_CACHE': '1'} if owns_cache else None
+    try:
+        if multiprocess:
+            run_supervisor(httpd, WORKERS, handoff_env)
+        else:
+            if hasattr(signal, 'SIGUSR2'):
+                signal.signal(signal.SIGHUP, lambda signum, frame: reload_config())
+                signal.signal(signal.SIGQUIT, lambda signum, frame: request_stop(httpd))
+                signal.signal(signal.SIGUSR2, lambda signum, frame: start_handoff(httpd, handoff_env))
+            notify_ready()
+            serve_and_drain(httpd)
+    finally:
+        if owns_cache and not HANDED_OFF.is_set():
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(cache_path + suffix)
+                except OSError:
+                    pass
+
+if __name__ == '__main__':
+    main()
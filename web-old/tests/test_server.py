@@ -0,0 +1,239 @@
+"""server.py 的行為測試 (標準函式庫 unittest，亦可用 pytest 執行)
+
+    cd web-old && python -m unittest discover tests
+"""
+import base64
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOME = tempfile.mkdtemp(prefix='clawchat-test-')
+# 匯入前隔離環境：不讀 .env、不碰真實的 ~/.openclaw
+os.environ.update({'HOME': HOME, 'ENV_FILE': os.path.join(HOME, '.env'), 'API_KEY': 'test-key'})
+for name in ('CACHE_DB', 'SHARED_CACHE_PATH', 'WORKERS', 'ATTACHMENT_DIR'):
+    os.environ.pop(name, None)
+sys.path.insert(0, SCRIPT_DIR)
+
+import server  # noqa: E402
+
+
+def tearDownModule():
+    shutil.rmtree(HOME, ignore_errors=True)
+
+
+class ServerThread:
+    """在背景執行緒啟動 ClawChatServer (隨機端口)"""
+    def __enter__(self):
+        self.httpd = server.ClawChatServer(('127.0.0.1', 0), server.CORSHTTPRequestHandler)
+        self.port = self.httpd.server_address[1]
+        self.connections = []
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        for conn in self.connections:
+            conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def connection(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        self.connections.append(conn)
+        return conn
+
+
+def session(sid, updated_at, agent_id='main'):
+    return {"id": sid, "updatedAt": updated_at, "agentId": agent_id}
+
+
+class SessionIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = server.SessionIndex()
+        self.index.update({"sessions": [session('a', 100), session('b', 200)], "count": 2, "fetchedAt": 1000})
+
+    def test_no_changes_returns_empty_delta(self):
+        version = self.index.query()['version']
+        result = self.index.query(since=version)
+        self.assertFalse(result['full'])
+        self.assertEqual(result['sessions'], [])
+        self.assertEqual(result['removed'], [])
+
+    def test_delta_contains_changed_and_new_sessions(self):
+        version = self.index.query()['version']
+        self.index.update({"sessions": [session('a', 100), session('b', 300), session('c', 50)],
+                           "count": 3, "fetchedAt": 2000})
+        result = self.index.query(since=version)
+        self.assertFalse(result['full'])
+        self.assertEqual({s['id'] for s in result['sessions']}, {'b', 'c'})
+        self.assertEqual(result['version'], 2000)
+
+    def test_removed_sessions_reported_after_version(self):
+        self.index.update({"sessions": [session('b', 200)], "count": 1, "fetchedAt": 2000})
+        self.assertEqual(self.index.query(since=1000)['removed'], ['a'])
+        self.assertEqual(self.index.query(since=2000)['removed'], [])
+
+    def test_since_before_baseline_returns_full_list(self):
+        result = self.index.query(since=500)
+        self.assertTrue(result['full'])
+        self.assertEqual(result['count'], 2)
+        self.assertEqual(result['removed'], [])
+
+    def test_delta_respects_filters(self):
+        self.index.update({"sessions": [session('a', 400, 'code'), session('b', 300)], "count": 2, "fetchedAt": 2000})
+        result = self.index.query({'agentId': ['code']}, since=1000)
+        self.assertEqual([s['id'] for s in result['sessions']], ['a'])
+
+
+class GetSessionsTest(unittest.TestCase):
+    def setUp(self):
+        server._cache.clear()
+        patcher = mock.patch.object(server, 'SESSION_INDEX', server.SessionIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_sessions(self, keys):
+        output = json.dumps({"sessions": [{"key": key, "sessionId": f"s{i}", "agentId": "main", "updatedAt": i}
+                                          for i, key in enumerate(keys)]})
+        completed = subprocess.CompletedProcess([], 0, stdout=output, stderr='')
+        handler = server.CORSHTTPRequestHandler.__new__(server.CORSHTTPRequestHandler)
+        with mock.patch('subprocess.run', return_value=completed):
+            return handler.get_sessions('/api/sessions')
+
+    def test_keys_without_session_timestamp(self):
+        result = self.get_sessions(['agent:main:telegram:123', 'agent:main:discord:456',
+                                    'agent:main:webchat', 'agent:main:cron:job-1'])
+        self.assertNotIn('error', result)
+        self.assertEqual(sorted(s['name'] for s in result['sessions']),
+                         ['Discord', 'Telegram', 'Webchat', '排程任務'])
+        self.assertIsInstance(result['fetchedAt'], int)
+
+    def test_session_timestamp_key(self):
+        result = self.get_sessions(['agent:main:openai-user:main_session_1700000000000'])
+        self.assertNotIn('error', result)
+        self.assertTrue(result['sessions'][0]['name'].startswith('新對話 '))
+
+
+class AttachmentTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(dir=HOME)
+        patcher = mock.patch.object(server, 'ATTACHMENT_DIR', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def store(self, data, mime):
+        digest = server.hashlib.sha256(data).hexdigest()
+        with open(server.attachment_path(digest), 'wb') as f:
+            f.write(data)
+        with open(server.attachment_path(digest) + '.json', 'w') as f:
+            json.dump({"mime": mime, "size": len(data)}, f)
+        return digest
+
+    def expand(self, body):
+        parts, total = server.expand_attachment_refs(body)
+        data = parts if isinstance(parts, bytes) else b''.join(parts)
+        self.assertEqual(len(data), total)
+        return json.loads(data)
+
+    def test_expands_to_data_url(self):
+        digest = self.store(b'\x89PNG data', 'image/png')
+        body = json.dumps({"image": f"attachment:{digest}", "text": "hi"}).encode()
+        expected = 'data:image/png;base64,' + base64.b64encode(b'\x89PNG data').decode()
+        self.assertEqual(self.expand(body), {"image": expected, "text": "hi"})
+
+    def test_stored_mime_cannot_inject_json(self):
+        digest = self.store(b'abc', 'image/png", "x": "y')
+        result = self.expand(json.dumps({"image": f"attachment:{digest}"}).encode())
+        self.assertEqual(list(result), ['image'])
+        self.assertEqual(result['image'], 'data:application/octet-stream;base64,YWJj')
+
+    def test_upload_rejects_non_image_types(self):
+        with ServerThread() as srv:
+            conn = srv.connection()
+            for mime, status in [('image/png", "x": "y', 415), ('text/html', 415), ('image/png', 200)]:
+                conn.request('POST', '/api/attachments', body=b'abc', headers={'Content-Type': mime})
+                resp = conn.getresponse()
+                resp.read()
+                self.assertEqual(resp.status, status, mime)
+                if status != 200:
+                    conn = srv.connection()  # 415 之後伺服器會關閉連線
+
+
+class KeepAliveTest(unittest.TestCase):
+    def test_unread_body_does_not_corrupt_next_request(self):
+        with ServerThread() as srv:
+            conn = srv.connection()
+            conn.request('GET', '/api/status', body=b'{"ignored": true}', headers={'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 200)
+            conn.request('GET', '/api/status')
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 200)
+
+    def test_profile_start_consumes_json_body(self):
+        headers = {'Authorization': 'Bearer test-key', 'Content-Type': 'application/json'}
+        with mock.patch.object(server, 'API_KEY', 'test-key'), ServerThread() as srv:
+            conn = srv.connection()
+            conn.request('POST', '/api/admin/profile/start', body=json.dumps({"mode": "cprofile", "requests": 2}),
+                         headers=headers)
+            resp = conn.getresponse()
+            self.assertEqual(json.loads(resp.read())['mode'], 'cprofile')
+            conn.request('POST', '/api/admin/profile/stop', headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            self.assertEqual(resp.status, 200)
+
+
+class StaticCacheTest(unittest.TestCase):
+    def get(self, conn, path, headers=None):
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        return resp, resp.read()
+
+    def test_index_references_versioned_assets(self):
+        with ServerThread() as srv:
+            conn = srv.connection()
+            _, body = self.get(conn, '/')
+            version = server.STATIC_ASSETS.get(os.path.join(SCRIPT_DIR, 'lib', 'vue.js')).version
+            self.assertIn(f'lib/vue.js?v={version}'.encode(), body)
+            resp, _ = self.get(conn, f'/lib/vue.js?v={version}')
+            self.assertIn('immutable', resp.getheader('Cache-Control'))
+
+    def test_unverified_version_is_revalidated(self):
+        with ServerThread() as srv:
+            conn = srv.connection()
+            for path in ('/lib/vue.js?v=1', '/lib/vue.js?v=deadbeefdeadbeef', '/lib/vue.js'):
+                resp, _ = self.get(conn, path)
+                self.assertEqual(resp.getheader('Cache-Control'), 'no-cache', path)
+
+    def test_etag_per_encoding(self):
+        with ServerThread() as srv:
+            conn = srv.connection()
+            plain, _ = self.get(conn, '/lib/vue.js')
+            gzipped, _ = self.get(conn, '/lib/vue.js', {'Accept-Encoding': 'gzip'})
+            self.assertEqual(gzipped.getheader('Content-Encoding'), 'gzip')
+            self.assertNotEqual(plain.getheader('ETag'), gzipped.getheader('ETag'))
+            # 任一編碼版本的 ETag 都可用於條件請求，回應帶目前選擇的版本
+            resp, _ = self.get(conn, '/lib/vue.js', {'If-None-Match': gzipped.getheader('ETag')})
+            self.assertEqual(resp.status, 304)
+            self.assertEqual(resp.getheader('ETag'), plain.getheader('ETag'))
+
+    def test_private_files_not_served(self):
+        with ServerThread() as srv:
+            for path in ('/server.py', '/.env', '/bench.py', '/tests/test_server.py'):
+                conn = srv.connection()
+                resp, _ = self.get(conn, path)
+                self.assertEqual(resp.status, 404, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 import { defineStore } from 'pinia'
-import { ref, computed, shallowRef } from 'vue'
+import { ref, computed, shallowRef, watch } from 'vue'
 import type { Agent, Model, Message, Session, Toast, UploadedImage, ViewType, CronJob, Schedule, SystemStatus, ChannelInfo } from '@/types'
 
 const STORAGE_KEY = 'clawchat_sessions'
@@ -343,17 +343,43 @@ export const useChatStore = defineStore('chat', () => {
   }
 
   // Image handling
+  // 上傳到伺服器的附件儲存區，之後的訊息只傳引用；相同內容 (SHA-256) 已存在時不重複上傳
+  const uploadAttachment = async (file: File): Promise<string | undefined> => {
+    try {
+      const buffer = await file.arrayBuffer()
+      if (window.crypto?.subtle) {
+        const digest = Array.from(new Uint8Array(await window.crypto.subtle.digest('SHA-256', buffer)))
+          .map(b => b.toString(16).padStart(2, '0')).join('')
+        const head = await fetch(`/api/attachments/${digest}`, { method: 'HEAD' })
+        if (head.ok) return `attachment:${digest}`
+      }
+      const res = await fetch('/api/attachments', {
+        method: 'POST',
+        headers: { 'Content-Type': file.type },
+        body: buffer
+      })
+      if (!res.ok) return undefined
+      return (await res.json()).ref
+    } catch (e) {
+      console.error('Failed to upload attachment:', e)
+      return undefined
+    }
+  }
+
   const handleImageUpload = (files: FileList) => {
     for (const file of files) {
       if (!file.type.startsWith('image/')) continue
       const reader = new FileReader()
       reader.onload = (e) => {
-        uploadedImages.value.push({
+        const image: UploadedImage = {
           name: file.name,
           type: file.type,
           dataUrl: e.target?.result as string,
           preview: e.target?.result as string
-        })
+        }
+        uploadedImages.value.push(image)
+        // 上傳完成前送出時仍使用 dataUrl
+        uploadAttachment(file).then(ref => { image.ref = ref })
       }
       reader.readAsDataURL(file)
     }
@@ -364,13 +390,16 @@ export const useChatStore = defineStore('chat', () => {
   }
 
   // API Calls
+  let sessionsVersion = 0  // 上次取得的索引版本 (伺服器回傳的 version)，之後只抓差異
   const fetchSessions = async () => {
     try {
-      const res = await fetch('/api/sessions')
+      const delta = sessionsVersion > 0 && sessions.value.some(s => s.isGateway)
+      const fields = 'sessions.id,sessions.key,sessions.name,sessions.label,sessions.agentId,sessions.source,sessions.updatedAt,removed,version,full'
+      const res = await fetch(`/api/sessions?fields=${fields}${delta ? `&since=${sessionsVersion}` : ''}`)
       const data = await res.json()
       
       // 直接使用 API 返回的數據
-      const gatewaySessions: Session[] = (data.sessions || []).map((gs: { id: string; key?: string; name?: string; label?: string; agentId: string; source?: string; updatedAt?: number }) => ({
+      let gatewaySessions: Session[] = (data.sessions || []).map((gs: { id: string; key?: string; name?: string; label?: string; agentId: string; source?: string; updatedAt?: number }) => ({
         id: gs.id,
         key: gs.key || gs.id,
         name: gs.name || gs.label || '新對話',
@@ -381,6 +410,15 @@ export const useChatStore = defineStore('chat', () => {
         updatedAt: gs.updatedAt
       }))
       
+      if (delta && !data.full) {
+        // 合併差異：移除已刪除與有更新的舊項目，加入新版本
+        const replaced = new Set([...(data.removed || []), ...gatewaySessions.map(s => s.id)])
+        gatewaySessions = sessions.value
+          .filter(s => s.isGateway && !replaced.has(s.id))
+          .concat(gatewaySessions)
+      }
+      if (!data.error) sessionsVersion = data.version || 0
+      
       if (gatewaySessions.length === 0) {
         gatewaySessions.push({ 
           id: `session_${Date.now()}`, 
@@ -401,19 +439,110 @@ export const useChatStore = defineStore('chat', () => {
     }
   }
 
+  // WebSocket：多個對話串流共用一條連線；無法連線時退回 POST /api/chat
+  type StreamHandler = { onData: (data: string) => void; resolve: () => void; reject: (e: Error) => void }
+  const streamHandlers = new Map<string, StreamHandler>()
+  let socketReady: Promise<WebSocket | null> | null = null
+  let socketRetryAt = 0
+
+  const connectSocket = (): Promise<WebSocket | null> => {
+    if (socketReady) return socketReady
+    if (typeof WebSocket === 'undefined' || Date.now() < socketRetryAt) return Promise.resolve(null)
+    socketReady = new Promise(resolve => {
+      const ws = new WebSocket(`${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}/api/ws`)
+      ws.onopen = () => {
+        if (currentSession.value) ws.send(JSON.stringify({ type: 'join', sessionId: currentSession.value }))
+        resolve(ws)
+      }
+      ws.onclose = (event) => {
+        socketReady = null
+        // 1012：伺服器重啟中，下一次請求直接重連新行程
+        socketRetryAt = event.code === 1012 ? 0 : Date.now() + 30000
+        for (const handler of streamHandlers.values()) handler.reject(new Error('WebSocket 連線中斷'))
+        streamHandlers.clear()
+        resolve(null)
+      }
+      ws.onmessage = (event) => {
+        const msg = JSON.parse(event.data)
+        const handler = msg.id ? streamHandlers.get(msg.id) : undefined
+        if (msg.type === 'chunk') {
+          handler?.onData(msg.data)
+        } else if (msg.type === 'done' || msg.type === 'cancelled') {
+          streamHandlers.delete(msg.id)
+          handler?.resolve()
+        } else if (msg.type === 'error') {
+          streamHandlers.delete(msg.id)
+          handler?.reject(new Error(msg.error || `HTTP ${msg.status}`))
+        } else if (msg.type === 'session') {
+          fetchSessions()
+        }
+      }
+    })
+    return socketReady
+  }
+
+  // presence：通知伺服器目前檢視的 session
+  watch(currentSession, async (next, prev) => {
+    const ws = socketReady ? await socketReady : null
+    if (!ws) return
+    if (prev) ws.send(JSON.stringify({ type: 'leave', sessionId: prev }))
+    if (next) ws.send(JSON.stringify({ type: 'join', sessionId: next }))
+  })
+
+  const streamChat = async (sessionId: string | null, body: object, onData: (data: string) => void) => {
+    const ws = await connectSocket()
+    if (ws) {
+      const id = `${Date.now()}-${Math.random().toString(36).slice(2)}`
+      return new Promise<void>((resolve, reject) => {
+        streamHandlers.set(id, { onData, resolve, reject })
+        ws.send(JSON.stringify({ type: 'chat', id, sessionId, body }))
+      })
+    }
+
+    const response = await fetch(`/api/chat`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify(body)
+    })
+
+    if (!response.ok) throw new Error(`HTTP ${response.status}`)
+
+    const reader = response.body?.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+
+    while (reader) {
+      const { done, value } = await reader.read()
+      if (done) break
+
+      buffer += decoder.decode(value, { stream: true })
+      const lines = buffer.split('\n')
+      buffer = lines.pop() || ''
+
+      for (const line of lines) {
+        if (line.startsWith('data: ')) onData(line.slice(6))
+      }
+    }
+  }
+
   const sendMessage = async () => {
     const text = inputText.value.trim()
     if ((!text && uploadedImages.value.length === 0) || isLoading.value) return
 
     // Build message content
     let messageContent: Message['content'] = text
+    let requestContent: Message['content'] = text
     if (uploadedImages.value.length > 0) {
       type ContentPart = { type: 'text'; text: string } | { type: 'image_url'; image_url: { url: string } }
       const parts: ContentPart[] = text ? [{ type: 'text', text }] : []
+      const requestParts: ContentPart[] = text ? [{ type: 'text', text }] : []
       for (const img of uploadedImages.value) {
         parts.push({ type: 'image_url', image_url: { url: img.dataUrl } })
+        // 已上傳的圖片只送引用，由伺服器轉發時展開
+        requestParts.push({ type: 'image_url', image_url: { url: img.ref || img.dataUrl } })
       }
       messageContent = parts
+      requestContent = requestParts
     }
 
     // Add user message
@@ -444,62 +573,42 @@ export const useChatStore = defineStore('chat', () => {
       const keySuffix = currentSessionData?.key ? currentSessionData.key.split(':').pop() : currentSession.value
       console.log('[sendMessage] using key suffix as userId:', keySuffix)
       
-      const response = await fetch(`/api/chat`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          model: `openclaw:${selectedAgent.value.id}`,
-          messages: [{ role: 'user', content: messageContent }],
-          stream: true,
-          user: keySuffix
-        })
-      })
-
-      if (!response.ok) throw new Error(`HTTP ${response.status}`)
-
       const assistantMsg: Message = { role: 'assistant', content: '', timestamp: Date.now() }
-      messages.value.push(assistantMsg)
-
-      const reader = response.body?.getReader()
-      const decoder = new TextDecoder()
-      let buffer = ''
-
-      while (reader) {
-        const { done, value } = await reader.read()
-        if (done) break
-
-        buffer += decoder.decode(value, { stream: true })
-        const lines = buffer.split('\n')
-        buffer = lines.pop() || ''
-
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const data = line.slice(6)
-            if (data === '[DONE]') continue
+      let started = false
+
+      await streamChat(currentSession.value, {
+        model: `openclaw:${selectedAgent.value.id}`,
+        messages: [{ role: 'user', content: requestContent }],
+        stream: true,
+        user: keySuffix
+      }, (data) => {
+        if (data === '[DONE]') return
+        if (!started) {
+          messages.value.push(assistantMsg)
+          started = true
+        }
 
-            try {
-              const chunk = JSON.parse(data)
-              if (chunk.type === 'response.output_text.delta') {
-                assistantMsg.content += chunk.delta || ''
-              } else {
-                const delta = chunk.choices?.[0]?.delta
-                if (delta?.content) {
-                  const items = delta.content
-                  if (Array.isArray(items)) {
-                    for (const item of items) {
-                      if (item.type === 'thinking') assistantMsg.thinking += item.thinking || ''
-                      else if (item.type === 'text') assistantMsg.content += item.text || ''
-                    }
-                  } else {
-                    assistantMsg.content += items
-                  }
+        try {
+          const chunk = JSON.parse(data)
+          if (chunk.type === 'response.output_text.delta') {
+            assistantMsg.content += chunk.delta || ''
+          } else {
+            const delta = chunk.choices?.[0]?.delta
+            if (delta?.content) {
+              const items = delta.content
+              if (Array.isArray(items)) {
+                for (const item of items) {
+                  if (item.type === 'thinking') assistantMsg.thinking += item.thinking || ''
+                  else if (item.type === 'text') assistantMsg.content += item.text || ''
                 }
+              } else {
+                assistantMsg.content += items
               }
-              messages.value = [...messages.value]
-            } catch { /* ignore */ }
+            }
           }
-        }
-      }
+          messages.value = [...messages.value]
+        } catch { /* ignore */ }
+      })
     } catch (error: unknown) {
       const errorMessage = error instanceof Error ? error.message : '發生未知錯誤'
       messages.value.push({ 
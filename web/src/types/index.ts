@@ -47,6 +47,7 @@ export interface UploadedImage {
   type: string
   dataUrl: string
   preview: string
+  ref?: string  // 伺服器附件引用 (attachment:<sha256>)
 }
 
 export interface FileItem {
@@ -25,7 +25,8 @@ export default defineConfig({
     proxy: {
       '/api': {
         target: 'http://localhost:8093',
-        changeOrigin: true
+        changeOrigin: true,
+        ws: true
       }
     }
   }